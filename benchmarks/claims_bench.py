@@ -0,0 +1,114 @@
+"""Нагрузочный тест выдачи товара несколькими процессами.
+
+Создаёт временную БД с товаром и оплаченными заказами, после чего
+несколько процессов одновременно выдают товар по этим заказам. Каждый
+заказ выдаётся дважды из разных процессов (как уведомление ЮKassa и
+кнопка "Проверить оплату" в соседних воркерах). Проверяется, что ни
+один заказ не получил два ключа и ни один ключ не ушёл в два заказа.
+Пропускная способность с ростом числа процессов падает: запись в SQLite
+идёт по одной транзакции за раз, и процессы делят одну блокировку.
+
+    python -m benchmarks.claims_bench [заказов] [процессы ...]
+"""
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+ORDERS = 2000
+STOCK = 1500  # меньше заказов: часть заказов должна получить OUT_OF_STOCK
+CONCURRENCY = 50
+WORKERS = (1, 2, 4)
+
+
+def prepare(path: str, orders: int):
+    """Создать БД с товаром и заказами (в отдельном процессе: config читает путь из окружения)"""
+    os.environ["DATABASE_PATH"] = path
+    from database import models
+    from database.pool import close_pool
+
+    models.init_db()
+    product_id = models.add_product("bench", "", 10.0, "\n".join(f"KEY-{i}" for i in range(STOCK)))
+    for i in range(orders):
+        # Заказ с уже истёкшим резервом: выдача идёт из свободного стока
+        order_id = models.reserve_order(i, "bench", product_id, "bench", 10.0, ttl_seconds=-1)
+        models.release_expired_reservations()
+        models.attach_payment(order_id, f"pay-{i}")
+    close_pool()
+
+
+def fulfill(args) -> list:
+    """Выдать товар по списку платежей, вернуть закреплённые (платёж, ключ)"""
+    path, payment_ids = args
+    os.environ["DATABASE_PATH"] = path
+    from database.db import begin_fulfillment, complete_fulfillment
+    from database.models import CLAIMED
+    from database.pool import close_pool
+    from database.writer import close_writer
+
+    async def run():
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+        claimed = []
+
+        async def one(payment_id):
+            async with semaphore:
+                result = await begin_fulfillment(payment_id)
+                if result['status'] == CLAIMED:
+                    claimed.extend((payment_id, item) for item in result['items'])
+                    await complete_fulfillment(result['order']['id'])
+
+        await asyncio.gather(*(one(payment_id) for payment_id in payment_ids))
+        return claimed
+
+    try:
+        return asyncio.run(run())
+    finally:
+        close_writer()
+        close_pool()
+
+
+def bench(ctx, orders: int, workers: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        process = ctx.Process(target=prepare, args=(path, orders))
+        process.start()
+        process.join()
+
+        payment_ids = [f"pay-{i}" for i in range(orders)]
+        # Каждый платёж попадает в два разных процесса (при одном процессе - дважды в него же)
+        slices = [payment_ids[w::workers] + payment_ids[(w + 1) % workers::workers]
+                  for w in range(workers)]
+
+        with ctx.Pool(workers) as pool:
+            started = time.perf_counter()
+            results = pool.map(fulfill, [(path, part) for part in slices])
+            elapsed = time.perf_counter() - started
+
+    claimed = [pair for part in results for pair in part]
+    orders_claimed = [payment_id for payment_id, _ in claimed]
+    keys = [key for _, key in claimed]
+    ok = (len(set(orders_claimed)) == len(orders_claimed)
+          and len(set(keys)) == len(keys)
+          and len(claimed) == min(orders, STOCK))
+    attempts = sum(len(part) for part in slices)
+    print(f"{workers:>9}{attempts / elapsed:>14.0f}{len(claimed):>10}"
+          f"{len(orders_claimed) - len(set(orders_claimed)):>12}"
+          f"{len(keys) - len(set(keys)):>11}  {'OK' if ok else 'ОШИБКА'}")
+    return ok
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else ORDERS
+    workers = [int(arg) for arg in sys.argv[2:]] or list(WORKERS)
+    ctx = multiprocessing.get_context("spawn")
+
+    print(f"заказов: {orders}, ключей: {STOCK}, ядер: {os.cpu_count()}")
+    print(f"{'процессов':>9}{'попыток/с':>14}{'выдано':>10}{'2 ключа':>12}{'2 заказа':>11}")
+    results = [bench(ctx, orders, count) for count in workers]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Микробенчмарк слоя рендеринга клавиатур.
+
+Сравнивает построение клавиатур заново (как раньше, на каждый callback)
+с готовыми/запомненными разметками: время и объём памяти на вызов.
+
+    python -m benchmarks.keyboards_bench
+"""
+import timeit
+import tracemalloc
+
+from keyboards.user_kb import main_menu_kb, back_to_main_kb, product_kb
+from keyboards.admin_kb import (
+    admin_menu_kb, admin_back_kb, admin_product_actions_kb, admin_confirm_delete_kb
+)
+
+NUMBER = 20000
+PRODUCT_IDS = 100
+
+CASES = [
+    ("main_menu_kb", main_menu_kb, ()),
+    ("back_to_main_kb", back_to_main_kb, ()),
+    ("admin_menu_kb", admin_menu_kb, ()),
+    ("admin_back_kb", admin_back_kb, ()),
+    ("product_kb", product_kb, (42,)),
+    ("admin_product_actions_kb", admin_product_actions_kb, (42,)),
+    ("admin_confirm_delete_kb", admin_confirm_delete_kb, (42,)),
+]
+
+
+def per_call_us(func, args) -> float:
+    """Среднее время одного вызова, мкс"""
+    return timeit.timeit(lambda: func(*args), number=NUMBER) / NUMBER * 1e6
+
+
+def allocated_bytes(func, args, calls: int = 1000) -> float:
+    """Средний объём памяти, выделенной за один вызов (результаты удерживаются)"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = [func(*args) for _ in range(calls)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del results
+    return (after - before) / calls
+
+
+def main():
+    print(f"{'клавиатура':<26}{'заново, мкс':>13}{'кэш, мкс':>10}{'заново, Б':>12}{'кэш, Б':>9}")
+    for name, cached, args in CASES:
+        fresh = cached.__wrapped__
+        cached(*args)  # прогрев запомненных
+        print(
+            f"{name:<26}"
+            f"{per_call_us(fresh, args):>13.2f}{per_call_us(cached, args):>10.2f}"
+            f"{allocated_bytes(fresh, args):>12.0f}{allocated_bytes(cached, args):>9.0f}"
+        )
+    
+    # Смешанная нагрузка по многим товарам: проверка попаданий в LRU
+    ids = [i % PRODUCT_IDS for i in range(NUMBER)]
+    fresh_time = timeit.timeit(lambda: [product_kb.__wrapped__(i) for i in ids], number=1)
+    cached_time = timeit.timeit(lambda: [product_kb(i) for i in ids], number=1)
+    print(f"\nproduct_kb по {PRODUCT_IDS} товарам, {NUMBER} вызовов: "
+          f"заново {fresh_time * 1000:.1f} мс, кэш {cached_time * 1000:.1f} мс "
+          f"({product_kb.cache_info()})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Бенчмарк полнотекстового поиска товаров.
+
+Заполняет временную БД товарами со сгенерированными названиями и
+описаниями и замеряет задержку поиска без кэша (FTS5-запрос) и из кэша.
+
+    python -m benchmarks.search_bench [товаров]
+"""
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+PRODUCTS = 10000
+QUERIES = 2000
+
+WORDS = (
+    "windows office steam netflix spotify xbox playstation adobe kaspersky eset "
+    "ключ аккаунт подписка лицензия премиум месяц год игра антивирус доступ "
+    "pro home ultimate standard deluxe gold silver global russia"
+).split()
+
+
+def fill(path: str, count: int):
+    """Наполнить БД товарами одной транзакцией"""
+    from database.migrations import apply_migrations
+    from database.pool import connect
+
+    rng = random.Random(1)
+    conn = connect(path)
+    apply_migrations(conn)
+    conn.executemany(
+        "INSERT INTO products (name, description, price) VALUES (?, ?, ?)",
+        (
+            (" ".join(rng.sample(WORDS, 3)) + f" #{i}", " ".join(rng.choices(WORDS, k=20)), 100)
+            for i in range(count)
+        )
+    )
+    conn.commit()
+    conn.close()
+
+
+def percentiles(samples: list) -> str:
+    samples = sorted(samples)
+    p50 = statistics.median(samples)
+    p99 = samples[int(len(samples) * 0.99) - 1]
+    return f"p50 {p50 * 1000:.2f} мс, p99 {p99 * 1000:.2f} мс"
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else PRODUCTS
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_PATH"] = os.path.join(tmp, "bench.db")
+        from database import db, models
+        from database.pool import close_pool
+        from database.writer import close_writer
+
+        started = time.perf_counter()
+        fill(os.environ["DATABASE_PATH"], count)
+        print(f"товаров: {count}, заполнение {time.perf_counter() - started:.1f} с")
+
+        rng = random.Random(2)
+        queries = [" ".join(word[:rng.randint(2, len(word))] for word in rng.sample(WORDS, rng.randint(1, 2)))
+                   for _ in range(QUERIES)]
+
+        raw = []
+        found = 0
+        for text in queries:
+            query = models.search_query(text)
+            started = time.perf_counter()
+            found += len(models.search_products(query, 20))
+            raw.append(time.perf_counter() - started)
+        print(f"FTS5 без кэша:  {percentiles(raw)} (в среднем {found / QUERIES:.1f} результатов)")
+
+        async def cached():
+            hot = queries[:50]
+            for text in hot:
+                await db.search_products(text)
+            samples = []
+            for i in range(QUERIES):
+                started = time.perf_counter()
+                await db.search_products(hot[i % len(hot)])
+                samples.append(time.perf_counter() - started)
+            return samples
+
+        print(f"горячие из кэша: {percentiles(asyncio.run(cached()))}")
+        close_writer()
+        close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -13,9 +13,130 @@ ADMIN_ID = int(os.getenv("ADMIN_ID"))
 YUKASSA_TOKEN = os.getenv("YUKASSA_TOKEN")
 YUKASSA_SHOP_ID = os.getenv("YUKASSA_SHOP_ID")
 
+# Таймаут запроса к ЮKassa (сек) и число повторов при 429/5xx
+YUKASSA_TIMEOUT = float(os.getenv("YUKASSA_TIMEOUT", "10"))
+YUKASSA_MAX_RETRIES = int(os.getenv("YUKASSA_MAX_RETRIES", "3"))
+
+# Кэш статусов платежей: сколько секунд верить статусу pending и сколько записей хранить
+PAYMENT_PENDING_TTL = float(os.getenv("PAYMENT_PENDING_TTL", "3"))
+PAYMENT_CACHE_SIZE = int(os.getenv("PAYMENT_CACHE_SIZE", "10000"))
+
 # База данных
 DATABASE_PATH = os.getenv("DATABASE_PATH", "shop.db")
 
+# Размер пула соединений с БД
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+
+# Настройки SQLite: размер mmap (байт) и ожидание блокировки (мс)
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", "5000"))
+
+# Групповой коммит: окно сбора записей (сек) и максимальный размер пачки
+DB_WRITE_BATCH_WINDOW = float(os.getenv("DB_WRITE_BATCH_WINDOW", "0.002"))
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "256"))
+# Повторы захвата блокировки записи, если её держит другой процесс бота
+DB_LOCK_RETRIES = int(os.getenv("DB_LOCK_RETRIES", "5"))
+
+# Регистрация пользователей: размер кэша известных и период записи пачки (сек)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "100000"))
+USER_FLUSH_INTERVAL = float(os.getenv("USER_FLUSH_INTERVAL", "2"))
+
+# Состояния FSM: период записи в БД, сколько доверять кэшу (при WEBHOOK_WORKERS > 1 кэша нет),
+# через сколько удалять брошенные состояния (сек) и размер кэша
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.5"))
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "5"))
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "86400"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+
+# Загрузка стока из файла: ключей в одной транзакции
+STOCK_IMPORT_CHUNK_SIZE = int(os.getenv("STOCK_IMPORT_CHUNK_SIZE", "5000"))
+
+# Сколько параметризованных клавиатур держать в памяти
+KEYBOARD_CACHE_SIZE = int(os.getenv("KEYBOARD_CACHE_SIZE", "1024"))
+
+# Ограничение частоты нажатий: префикс callback_data -> (запросов в секунду, всплеск)
+THROTTLE_RULES = {
+    "check_payment_": (0.2, 2),
+    "buy_": (0.5, 2),
+    "": (3, 6),
+}
+THROTTLE_IDLE_TTL = int(os.getenv("THROTTLE_IDLE_TTL", "600"))
+
+# Количество товаров на одной странице каталога и админ-списка
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "10"))
+
+# Количество заказов на одной странице в админке
+ORDERS_PAGE_SIZE = int(os.getenv("ORDERS_PAGE_SIZE", "10"))
+
+# Поиск: результатов на страницу, сколько Telegram кэширует ответ inline-режима (сек)
+# и предел записей кэша каталога (вместе с результатами поиска)
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+SEARCH_CACHE_TIME = int(os.getenv("SEARCH_CACHE_TIME", "30"))
+PRODUCTS_CACHE_SIZE = int(os.getenv("PRODUCTS_CACHE_SIZE", "10000"))
+
+# Покупка нескольких единиц: варианты количества на карточке, максимум в заказе и
+# сколько единиц выдавать сообщением (больше - .txt-файлом)
+ORDER_QUANTITY_OPTIONS = tuple(int(value) for value in os.getenv("ORDER_QUANTITY_OPTIONS", "5,10,50,100").split(","))
+MAX_ORDER_QUANTITY = int(os.getenv("MAX_ORDER_QUANTITY", "100"))
+DELIVERY_INLINE_MAX_ITEMS = int(os.getenv("DELIVERY_INLINE_MAX_ITEMS", "20"))
+
+# Резерв единицы товара на время оплаты (сек) и период очистки просроченных резервов
+STOCK_RESERVATION_TTL = int(os.getenv("STOCK_RESERVATION_TTL", "900"))
+RESERVATION_SWEEP_INTERVAL = int(os.getenv("RESERVATION_SWEEP_INTERVAL", "30"))
+
+# Фоновая сверка неоплаченных заказов
+RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", "60"))  # пауза между проходами, сек
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "100"))
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "5"))
+RECONCILE_RATE = float(os.getenv("RECONCILE_RATE", "2"))  # запросов к ЮKassa в секунду
+RECONCILE_MIN_AGE = int(os.getenv("RECONCILE_MIN_AGE", "60"))  # не трогать свежие заказы, сек
+ORDER_EXPIRE_MINUTES = int(os.getenv("ORDER_EXPIRE_MINUTES", "60"))
+# Сколько часов сверять отменённые/просроченные заказы, чей платёж в ЮKassa ещё можно оплатить
+CLOSED_ORDER_RECHECK_HOURS = int(os.getenv("CLOSED_ORDER_RECHECK_HOURS", "24"))
+FULFILLMENT_TIMEOUT = int(os.getenv("FULFILLMENT_TIMEOUT", "120"))  # довыдать зависшие в fulfilling, сек
+FULFILLMENT_MAX_ATTEMPTS = int(os.getenv("FULFILLMENT_MAX_ATTEMPTS", "5"))  # после стольких неудач - failed
+
+# Рассылка: сообщений в секунду (лимит Telegram ~30), параллельных отправок, размер пачки
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "100"))
+
+# Сколько апдейтов обрабатывать одновременно (апдейты одного пользователя - по очереди)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "50"))
+# Сколько ждать незавершённые апдейты и выдачи при остановке, сек
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30"))
+
+# Количество процессов-воркеров в режиме вебхука (общий порт через SO_REUSEPORT)
+# и как часто воркеры сверяют версию кэша каталога, сек
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))
+CACHE_SYNC_INTERVAL = float(os.getenv("CACHE_SYNC_INTERVAL", "1"))
+
+# Локальный HTTP-адрес метрик Prometheus (GET /metrics), по умолчанию выключено (0).
+# Воркер N слушает METRICS_PORT + N
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Режим запуска: polling или webhook
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+
+# Вебхук: публичный адрес (https://example.com), пути и адрес локального сервера
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+
+# Уведомления ЮKassa и адреса, с которых они принимаются
+YUKASSA_WEBHOOK_PATH = os.getenv("YUKASSA_WEBHOOK_PATH", "/yookassa/webhook")
+YUKASSA_WEBHOOK_IPS = os.getenv(
+    "YUKASSA_WEBHOOK_IPS",
+    "185.71.76.0/27,185.71.77.0/27,77.75.153.0/25,77.75.156.11/32,"
+    "77.75.156.35/32,77.75.154.128/25,2a02:5180::/32"
+)
+# Адреса своего обратного прокси (nginx и т.п.): для запросов с них адрес
+# клиента берётся из X-Forwarded-For. Пусто - заголовок не учитывается
+TRUSTED_PROXIES = os.getenv("TRUSTED_PROXIES", "")
+
 # Проверка наличия обязательных переменных
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не установлен в .env файле")
@@ -0,0 +1,76 @@
+"""Версионный кэш товаров.
+
+Любое изменение товаров или стока увеличивает версию и сбрасывает кэш,
+поэтому просмотр каталога не обращается к БД, пока что-то не изменится.
+Кроме строк из БД здесь же хранятся отрендеренные клавиатура каталога
+и карточки товаров.
+
+Когда бот запущен несколькими процессами, локальные bump() копятся и
+публикуются в общую таблицу cache_versions (services/cache_sync.py),
+а чужие публикации сбрасывают кэш через invalidate().
+"""
+from typing import Any, Awaitable, Callable, Hashable
+
+from config import PRODUCTS_CACHE_SIZE
+
+_MISSING = object()
+
+
+class VersionedCache:
+    """Кэш с единым счётчиком версий"""
+
+    def __init__(self, max_entries: int = None):
+        self.version = 0
+        self.max_entries = max_entries
+        self._entries = {}
+        self._unpublished = False
+
+    def invalidate(self):
+        """Сбросить все записи (без публикации другим процессам)"""
+        self.version += 1
+        self._entries.clear()
+
+    def bump(self):
+        """Инвалидировать все записи после изменения данных"""
+        self.invalidate()
+        self._unpublished = True
+
+    def take_unpublished(self) -> bool:
+        """Были ли изменения с прошлого вызова (флаг сбрасывается)"""
+        unpublished, self._unpublished = self._unpublished, False
+        return unpublished
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != self.version:
+            return default
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, version: int = None):
+        """Сохранить значение (если версия не успела смениться)"""
+        version = self.version if version is None else version
+        if version == self.version:
+            # Пользовательские ключи (поисковые запросы) не должны расти без предела
+            if self.max_entries and len(self._entries) >= self.max_entries and key not in self._entries:
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = (version, value)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Взять значение из кэша или загрузить его асинхронно"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            version = self.version
+            value = await loader()
+            self.set(key, value, version)
+        return value
+
+    def get_or_build(self, key: Hashable, builder: Callable[[], Any]) -> Any:
+        """Взять значение из кэша или построить его синхронно"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = builder()
+            self.set(key, value)
+        return value
+
+
+products_cache = VersionedCache(PRODUCTS_CACHE_SIZE)
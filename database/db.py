@@ -0,0 +1,236 @@
+"""Асинхронный доступ к БД.
+
+Обёртки над функциями database.models, которые выполняются в пуле
+соединений и не блокируют event loop. Хендлеры должны использовать
+этот модуль, а не models напрямую.
+"""
+from typing import Iterable, List, Optional, Dict
+
+from database import models
+from database.cache import products_cache
+from database.pool import get_pool
+from database.writer import get_writer
+
+
+async def _run(func, *args, **kwargs):
+    """Чтение: выполнить в пуле соединений"""
+    return await get_pool().run(func, *args, **kwargs)
+
+async def _write(func, *args, **kwargs):
+    """Запись: выполнить через писателя с групповым коммитом"""
+    return await get_writer().submit(func, *args, **kwargs)
+
+# === ТОВАРЫ ===
+
+async def add_product(name: str, description: str, price: float, stock: str = "",
+                      product_type: str = "text") -> int:
+    """Добавить товар"""
+    product_id = await _write(models.add_product, name, description, price, stock, product_type)
+    products_cache.bump()
+    return product_id
+
+async def get_product(product_id: int) -> Optional[Dict]:
+    """Получить товар по ID"""
+    return await products_cache.get_or_load(
+        ('product', product_id), lambda: _run(models.get_product, product_id)
+    )
+
+async def get_products_page(cursor: int = 0, direction: str = 'next', limit: int = 10,
+                            with_stock: bool = False) -> Dict:
+    """Страница товаров (keyset-пагинация по id)"""
+    return await products_cache.get_or_load(
+        ('products_page', cursor, direction, limit, with_stock),
+        lambda: _run(models.get_products_page, cursor, direction, limit, with_stock)
+    )
+
+async def search_products(text: str, limit: int = 20, offset: int = 0) -> List[Dict]:
+    """Полнотекстовый поиск товаров (результаты кэшируются до изменения товаров)"""
+    query = models.search_query(text)
+    if not query:
+        return []
+    return await products_cache.get_or_load(
+        ('search', query, limit, offset),
+        lambda: _run(models.search_products, query, limit, offset)
+    )
+
+async def update_product(product_id: int, name: str = None, description: str = None,
+                         price: float = None, product_type: str = None):
+    """Обновить товар"""
+    await _write(models.update_product, product_id, name=name, description=description,
+               price=price, product_type=product_type)
+    products_cache.bump()
+
+async def delete_product(product_id: int):
+    """Удалить товар"""
+    await _write(models.delete_product, product_id)
+    products_cache.bump()
+
+async def add_stock_items(product_id: int, items: Iterable[str]) -> int:
+    """Добавить единицы товара в сток"""
+    added = await _write(models.add_stock_items, product_id, items)
+    products_cache.bump()
+    return added
+
+async def replace_stock(product_id: int, item: str):
+    """Заменить свободный сток одной единицей"""
+    await _write(models.replace_stock, product_id, item)
+    products_cache.bump()
+
+async def get_stock_count(product_id: int) -> int:
+    """Количество непроданных единиц товара"""
+    return await _run(models.get_stock_count, product_id)
+
+async def release_expired_reservations(limit: int = 500) -> int:
+    """Вернуть в сток пачку просроченных резервов"""
+    released = await _write(models.release_expired_reservations, limit)
+    if released:
+        products_cache.bump()
+    return released
+
+# === ЗАКАЗЫ ===
+
+async def reserve_order(user_id: int, username: str, product_id: int, product_name: str,
+                        price: float, ttl_seconds: int, quantity: int = 1) -> Optional[int]:
+    """Создать заказ с резервом quantity единиц товара (price - сумма заказа)"""
+    order_id = await _write(models.reserve_order, user_id, username, product_id,
+                            product_name, price, ttl_seconds, quantity)
+    if order_id is not None:
+        products_cache.bump()
+    return order_id
+
+async def attach_payment(order_id: int, payment_id: str, payment_url: str = None):
+    """Привязать платёж к заказу"""
+    await _write(models.attach_payment, order_id, payment_id, payment_url)
+
+async def get_active_order(user_id: int, product_id: int) -> Optional[Dict]:
+    """Неоплаченный заказ пользователя на товар с действующим резервом"""
+    return await _run(models.get_active_order, user_id, product_id)
+
+async def cancel_order(order_id: int, user_id: int = None) -> bool:
+    """Отменить неоплаченный заказ и снять резерв"""
+    canceled = await _write(models.cancel_order, order_id, user_id)
+    if canceled:
+        products_cache.bump()
+    return canceled
+
+async def get_order_by_payment(payment_id: str) -> Optional[Dict]:
+    """Получить заказ по ID платежа"""
+    return await _run(models.get_order_by_payment, payment_id)
+
+async def update_order_status(payment_id: str, status: str, from_status: str = None) -> bool:
+    """Обновить статус заказа"""
+    updated = await _write(models.update_order_status, payment_id, status, from_status)
+    if updated and status in ('canceled', 'expired'):
+        products_cache.bump()
+    return updated
+
+async def begin_fulfillment(payment_id: str) -> Dict:
+    """Начать выдачу оплаченного заказа (атомарно)"""
+    result = await _write(models.begin_fulfillment, payment_id)
+    # Выдача или снятие частичного резерва меняют сток
+    if result['items'] or result['status'] == models.OUT_OF_STOCK:
+        products_cache.bump()
+    return result
+
+async def complete_fulfillment(order_id: int) -> bool:
+    """Отметить заказ выданным"""
+    return await _write(models.complete_fulfillment, order_id)
+
+async def get_stale_fulfillments(older_than_seconds: int, limit: int = 100, after_id: int = 0) -> List[Dict]:
+    """Заказы, застрявшие в fulfilling (keyset по id)"""
+    return await _run(models.get_stale_fulfillments, older_than_seconds, limit, after_id)
+
+async def record_delivery_failure(order_id: int, max_attempts: int) -> bool:
+    """Учесть неудачную повторную доставку; True - заказ переведён в failed"""
+    return await _write(models.record_delivery_failure, order_id, max_attempts)
+
+async def get_pending_orders(after_id: int = 0, limit: int = 100, min_age_seconds: int = 0) -> List[Dict]:
+    """Получить пачку неоплаченных заказов"""
+    return await _run(models.get_pending_orders, after_id, limit, min_age_seconds)
+
+async def get_closed_unpaid_orders(after_id: int = 0, limit: int = 100,
+                                  max_age_hours: int = 24) -> List[Dict]:
+    """Отменённые/просроченные заказы с ещё открытым платежом"""
+    return await _run(models.get_closed_unpaid_orders, after_id, limit, max_age_hours)
+
+async def close_payment_link(payment_id: str):
+    """Отметить платёж заказа окончательно отменённым в ЮKassa"""
+    await _write(models.close_payment_link, payment_id)
+
+async def get_recent_orders(limit: int = 10, before_cursor: int = None, status: str = None,
+                            user_id: int = None) -> List[Dict]:
+    """Последние заказы (keyset-пагинация)"""
+    return await _run(models.get_recent_orders, limit, before_cursor, status, user_id)
+
+async def get_orders_stats() -> Dict:
+    """Получить статистику заказов"""
+    return await _run(models.get_orders_stats)
+
+# === ПОЛЬЗОВАТЕЛИ ===
+
+async def upsert_users(users: List[tuple]):
+    """Добавить/обновить пользователей пачкой"""
+    await _write(models.upsert_users, users)
+
+async def get_user_ids_page(after_id: int = 0, limit: int = 1000) -> List[int]:
+    """Страница ID активных пользователей (keyset по user_id)"""
+    return await _run(models.get_user_ids_page, after_id, limit)
+
+async def get_users_count() -> int:
+    """Количество активных пользователей"""
+    return await _run(models.get_users_count)
+
+async def mark_users_blocked(user_ids: List[int]):
+    """Отметить пользователей, заблокировавших бота"""
+    await _write(models.mark_users_blocked, user_ids)
+
+# === РАССЫЛКИ ===
+
+async def create_broadcast(from_chat_id: int, message_id: int) -> int:
+    """Создать рассылку"""
+    return await _write(models.create_broadcast, from_chat_id, message_id)
+
+async def get_broadcast(broadcast_id: int) -> Optional[Dict]:
+    """Рассылка по ID"""
+    return await _run(models.get_broadcast, broadcast_id)
+
+async def get_latest_broadcast() -> Optional[Dict]:
+    """Последняя рассылка"""
+    return await _run(models.get_latest_broadcast)
+
+async def get_running_broadcast() -> Optional[Dict]:
+    """Незавершённая рассылка"""
+    return await _run(models.get_running_broadcast)
+
+async def save_broadcast_progress(broadcast_id: int, last_user_id: int, sent: int, failed: int,
+                                  blocked: int):
+    """Сохранить позицию рассылки"""
+    await _write(models.save_broadcast_progress, broadcast_id, last_user_id, sent, failed, blocked)
+
+async def finish_broadcast(broadcast_id: int, status: str = 'done') -> bool:
+    """Завершить рассылку"""
+    return await _write(models.finish_broadcast, broadcast_id, status)
+
+# === СОСТОЯНИЯ FSM ===
+
+async def get_fsm_record(key: str) -> Optional[Dict]:
+    """Состояние и данные FSM по ключу"""
+    return await _run(models.get_fsm_record, key)
+
+async def save_fsm_records(records: List[tuple]):
+    """Записать состояния FSM пачкой"""
+    await _write(models.save_fsm_records, records)
+
+async def delete_stale_fsm_records(ttl_seconds: int) -> int:
+    """Удалить давно не менявшиеся состояния FSM"""
+    return await _write(models.delete_stale_fsm_records, ttl_seconds)
+
+# === ВЕРСИИ КЭШЕЙ ===
+
+async def get_cache_version(name: str) -> int:
+    """Общая версия кэша"""
+    return await _run(models.get_cache_version, name)
+
+async def bump_cache_version(name: str) -> int:
+    """Опубликовать изменение кэша для других процессов"""
+    return await _write(models.bump_cache_version, name)
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from database.db import get_fsm_record, save_fsm_records, delete_stale_fsm_records
+
+logger = logging.getLogger(__name__)
+
+# Как часто удалять брошенные состояния из БД, сек
+CLEANUP_INTERVAL = 3600
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в SQLite с отложенной записью
+
+    Состояние и данные каждого ключа держатся в памяти (ограниченный LRU).
+    Изменения только помечают ключ как изменённый; фоновый run() раз в
+    flush_interval записывает все изменённые ключи одной пачкой, так что
+    несколько update_data подряд дают одну запись в БД.
+
+    Чтение идёт из памяти. Неизменённая запись считается свежей cache_ttl
+    секунд, после чего перечитывается из БД. Состояния, не менявшиеся
+    дольше state_ttl, удаляются из БД.
+
+    Если с БД работают несколько процессов (write_through=True), апдейты
+    одного пользователя попадают в разные процессы: тогда каждое изменение
+    сразу пишется в БД, а чтение всегда идёт из БД, иначе процесс увидит
+    устаревшее состояние.
+    """
+
+    def __init__(self, flush_interval: float = 0.5, cache_ttl: float = 5,
+                 state_ttl: int = 86400, max_cached: int = 10000,
+                 write_through: bool = False):
+        self.flush_interval = flush_interval
+        self.write_through = write_through
+        self.cache_ttl = 0 if write_through else cache_ttl
+        self.state_ttl = state_ttl
+        self.max_cached = max_cached
+        # ключ -> [состояние, данные, время загрузки]
+        self._cache: OrderedDict = OrderedDict()
+        self._dirty = set()
+        self._last_cleanup = time.monotonic()
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id,
+            key.business_connection_id, key.destiny
+        ))
+
+    async def _entry(self, key: StorageKey) -> list:
+        """Запись кэша по ключу, при необходимости загруженная из БД"""
+        key = self._key(key)
+        entry = self._cache.get(key)
+        if entry is not None and (key in self._dirty or time.monotonic() - entry[2] < self.cache_ttl):
+            self._cache.move_to_end(key)
+            return entry
+
+        record = await get_fsm_record(key)
+        # Пока шла загрузка, ключ мог измениться в этом процессе
+        if key in self._dirty:
+            return self._cache[key]
+
+        if record is None:
+            entry = [None, {}, time.monotonic()]
+        else:
+            entry = [record['state'], json.loads(record['data']), time.monotonic()]
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        self._evict()
+        return entry
+
+    def _evict(self):
+        """Вытеснить старые записи, кроме ещё не записанных в БД"""
+        if len(self._cache) <= self.max_cached:
+            return
+        for key in list(self._cache):
+            if len(self._cache) <= self.max_cached:
+                break
+            if key not in self._dirty:
+                del self._cache[key]
+
+    async def _changed(self, key: StorageKey, entry: list):
+        """Изменение записи: сразу в БД (write_through) или в следующую пачку"""
+        key = self._key(key)
+        if self.write_through:
+            await save_fsm_records([(key, entry[0], json.dumps(entry[1], ensure_ascii=False))])
+        else:
+            self._dirty.add(key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key)
+        entry[0] = state.state if isinstance(state, State) else state
+        await self._changed(key, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        entry = await self._entry(key)
+        entry[1] = data.copy()
+        await self._changed(key, entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._entry(key))[1].copy()
+
+    async def flush(self):
+        """Записать изменённые состояния одной пачкой"""
+        if not self._dirty:
+            return
+
+        dirty, self._dirty = self._dirty, set()
+        now = time.monotonic()
+        records = []
+        for key in dirty:
+            entry = self._cache[key]
+            entry[2] = now
+            records.append((key, entry[0], json.dumps(entry[1], ensure_ascii=False)))
+        try:
+            await save_fsm_records(records)
+        except Exception:
+            self._dirty |= dirty
+            raise
+
+    async def cleanup(self):
+        """Удалить брошенные состояния из БД и устаревшие записи из памяти"""
+        removed = await delete_stale_fsm_records(self.state_ttl)
+        if removed:
+            logger.info("Удалено устаревших состояний FSM: %s", removed)
+
+        now = time.monotonic()
+        expired = [key for key, entry in self._cache.items()
+                   if key not in self._dirty and now - entry[2] > self.cache_ttl]
+        for key in expired:
+            del self._cache[key]
+        self._last_cleanup = now
+
+    async def run(self):
+        """Периодическая запись изменений и очистка"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_cleanup > CLEANUP_INTERVAL:
+                    await self.cleanup()
+            except Exception:
+                logger.exception("Ошибка записи состояний FSM")
+
+    async def close(self) -> None:
+        await self.flush()
@@ -0,0 +1,324 @@
+"""Версионные миграции схемы БД.
+
+Текущая версия схемы хранится в PRAGMA user_version. При запуске
+применяются только миграции с номером больше текущего, каждая в своей
+транзакции. Если схема актуальна, init_db ограничивается чтением версии.
+
+Новая миграция - функция migration_N(cursor), добавленная в конец MIGRATIONS.
+Уже выпущенные миграции не меняются.
+"""
+import logging
+import sqlite3
+
+from database.rollups import create_rollup_tables, backfill
+
+logger = logging.getLogger(__name__)
+
+
+def migration_1(cursor: sqlite3.Cursor):
+    """Базовые таблицы"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            price REAL NOT NULL,
+            stock TEXT,
+            product_type TEXT DEFAULT 'text',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Старые БД создавались без типа товара
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(products)")]
+    if 'product_type' not in columns:
+        cursor.execute("ALTER TABLE products ADD COLUMN product_type TEXT DEFAULT 'text'")
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            product_id INTEGER NOT NULL,
+            product_name TEXT NOT NULL,
+            price REAL NOT NULL,
+            payment_id TEXT UNIQUE,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def migration_2(cursor: sqlite3.Cursor):
+    """Сток: одна строка на единицу товара вместо текста в products.stock"""
+    from database.models import parse_stock_lines
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stock_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            order_id INTEGER,
+            claimed_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        )
+    """)
+    # Частичный индекс по свободным единицам: выдача и подсчёт не трогают проданные
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_stock_items_available
+        ON stock_items (product_id, id) WHERE order_id IS NULL
+    """)
+    
+    cursor.execute(
+        "SELECT id, stock, product_type FROM products WHERE stock IS NOT NULL AND stock != ''"
+    )
+    for product_id, stock, product_type in cursor.fetchall():
+        items = [stock] if product_type == 'file' else parse_stock_lines(stock)
+        cursor.executemany(
+            "INSERT INTO stock_items (product_id, content) VALUES (?, ?)",
+            ((product_id, item) for item in items)
+        )
+        cursor.execute("UPDATE products SET stock = NULL WHERE id = ?", (product_id,))
+
+
+def migration_3(cursor: sqlite3.Cursor):
+    """Индексы для ленты последних заказов и фильтров по статусу/покупателю"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_created_at ON orders (status, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_created_at ON orders (user_id, created_at)")
+
+
+def migration_4(cursor: sqlite3.Cursor):
+    """Агрегаты продаж (с пересчётом по уже оплаченным заказам)"""
+    create_rollup_tables(cursor)
+    if not cursor.execute("SELECT 1 FROM sales_totals").fetchone():
+        backfill(cursor)
+
+
+def migration_5(cursor: sqlite3.Cursor):
+    """Индекс заказов по товару
+
+    Запросы WHERE status = ? обслуживает idx_orders_status_created_at
+    (status - его первая колонка), отдельный индекс по status не нужен.
+    """
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_product_id ON orders (product_id)")
+
+
+def migration_6(cursor: sqlite3.Cursor):
+    """Хэш содержимого стока для поиска дубликатов при загрузке"""
+    from database.models import stock_hash
+    
+    cursor.execute("ALTER TABLE stock_items ADD COLUMN content_hash INTEGER")
+    
+    last_id = 0
+    while True:
+        rows = cursor.execute(
+            "SELECT id, content FROM stock_items WHERE id > ? ORDER BY id LIMIT 5000",
+            (last_id,)
+        ).fetchall()
+        if not rows:
+            break
+        cursor.executemany(
+            "UPDATE stock_items SET content_hash = ? WHERE id = ?",
+            [(stock_hash(content), item_id) for item_id, content in rows]
+        )
+        last_id = rows[-1][0]
+    
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_stock_items_hash ON stock_items (product_id, content_hash)"
+    )
+
+
+def migration_7(cursor: sqlite3.Cursor):
+    """Статусы выдачи заказа: paid -> delivered"""
+    cursor.execute("UPDATE orders SET status = 'delivered' WHERE status = 'paid'")
+
+
+def migration_8(cursor: sqlite3.Cursor):
+    """Резерв стока на время оплаты"""
+    cursor.execute("ALTER TABLE stock_items ADD COLUMN reserved_until TIMESTAMP")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_stock_items_reserved_until
+        ON stock_items (reserved_until) WHERE reserved_until IS NOT NULL
+    """)
+
+
+def migration_9(cursor: sqlite3.Cursor):
+    """Хранилище состояний FSM"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states (updated_at)")
+
+
+def migration_10(cursor: sqlite3.Cursor):
+    """Общие версии кэшей для нескольких процессов"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+
+def migration_11(cursor: sqlite3.Cursor):
+    """Рассылки и отметка заблокировавших бота пользователей"""
+    cursor.execute("ALTER TABLE users ADD COLUMN blocked INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+
+
+def migration_12(cursor: sqlite3.Cursor):
+    """Количество единиц в заказе (price - сумма всего заказа)"""
+    cursor.execute("ALTER TABLE orders ADD COLUMN quantity INTEGER NOT NULL DEFAULT 1")
+
+
+def migration_13(cursor: sqlite3.Cursor):
+    """Полнотекстовый поиск по товарам (FTS5, синхронизация триггерами)"""
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, description,
+            content = 'products', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, description ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO products_fts (rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END
+    """)
+    cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+
+def migration_14(cursor: sqlite3.Cursor):
+    """Счётчик неудачных повторных доставок заказа"""
+    cursor.execute("ALTER TABLE orders ADD COLUMN delivery_attempts INTEGER NOT NULL DEFAULT 0")
+
+
+def migration_15(cursor: sqlite3.Cursor):
+    """Индекс единиц стока по заказу (резервы, выдача, отмена)"""
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_stock_items_order_id
+        ON stock_items (order_id) WHERE order_id IS NOT NULL
+    """)
+
+
+def migration_16(cursor: sqlite3.Cursor):
+    """Ссылка на оплату заказа (повторный показ вместо нового платежа)"""
+    cursor.execute("ALTER TABLE orders ADD COLUMN payment_url TEXT")
+
+
+def migration_17(cursor: sqlite3.Cursor):
+    """Время последнего перехода заказа в fulfilling (от него считается зависание)"""
+    cursor.execute("ALTER TABLE orders ADD COLUMN fulfilling_since TIMESTAMP")
+    cursor.execute("""
+        UPDATE orders SET fulfilling_since = (
+            SELECT MAX(claimed_at) FROM stock_items WHERE order_id = orders.id
+        )
+        WHERE status = 'fulfilling'
+    """)
+
+
+MIGRATIONS = [
+    migration_1,
+    migration_2,
+    migration_3,
+    migration_4,
+    migration_5,
+    migration_6,
+    migration_7,
+    migration_8,
+    migration_9,
+    migration_10,
+    migration_11,
+    migration_12,
+    migration_13,
+    migration_14,
+    migration_15,
+    migration_16,
+    migration_17,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Текущая версия схемы"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """
+    Применить недостающие миграции
+    
+    Returns:
+        количество применённых миграций
+    """
+    current = get_schema_version(conn)
+    if current >= SCHEMA_VERSION:
+        return 0
+    
+    applied = 0
+    for version in range(current + 1, SCHEMA_VERSION + 1):
+        migration = MIGRATIONS[version - 1]
+        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        # Другой процесс бота мог применить миграцию, пока ждали блокировку
+        if get_schema_version(conn) >= version:
+            conn.rollback()
+            continue
+        try:
+            migration(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied += 1
+        logger.info("Применена миграция %s: %s", version, migration.__doc__.splitlines()[0])
+    
+    return applied
@@ -1,101 +1,186 @@
-import sqlite3
+import hashlib
+import json
+import re
 from datetime import datetime
-from config import DATABASE_PATH
-from typing import List, Optional, Dict
+from database.pool import get_pool
+from database.migrations import apply_migrations
+from database.rollups import record_sale
+from database.writer import current_write_connection
+from services.metrics import instrument_module
+from typing import Iterable, List, Optional, Dict
+
+# Колонки товара без устаревшего поля stock (сток хранится в stock_items)
+PRODUCT_COLUMNS = "id, name, description, price, product_type, created_at"
+
+# Добавление единицы стока, если такой же ещё нет у товара (поиск по хэшу)
+INSERT_STOCK_ITEM_SQL = """
+    INSERT INTO stock_items (product_id, content, content_hash)
+    SELECT ?1, ?2, ?3
+    WHERE NOT EXISTS (
+        SELECT 1 FROM stock_items
+        WHERE product_id = ?1 AND content_hash = ?3 AND content = ?2
+    )
+"""
+
+# Статусы заказа: pending -> fulfilling -> delivered / failed (+ canceled, expired)
+ORDER_PENDING = 'pending'
+ORDER_FULFILLING = 'fulfilling'
+ORDER_DELIVERED = 'delivered'
+ORDER_FAILED = 'failed'
+
+# Результаты начала выдачи заказа
+CLAIMED = 'claimed'
+ALREADY_DELIVERED = 'already_delivered'
+IN_PROGRESS = 'in_progress'
+ORDER_NOT_FOUND = 'order_not_found'
+PRODUCT_NOT_FOUND = 'product_not_found'
+OUT_OF_STOCK = 'out_of_stock'
+
+# Количество непроданных единиц товара
+STOCK_COUNT_SQL = "(SELECT COUNT(*) FROM stock_items s WHERE s.product_id = products.id AND s.order_id IS NULL)"
 
 def get_connection():
-    """Получить соединение с БД"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """
+    Получить соединение с БД (используется как контекстный менеджер)
+    
+    Внутри потока-писателя возвращается его соединение с открытой
+    транзакцией пачки, иначе - соединение из пула.
+    """
+    return current_write_connection() or get_pool().connection()
 
 def init_db():
-    """Инициализация базы данных"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Таблица товаров
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            price REAL NOT NULL,
-            stock TEXT,
-            product_type TEXT DEFAULT 'text',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Таблица заказов
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            username TEXT,
-            product_id INTEGER NOT NULL,
-            product_name TEXT NOT NULL,
-            price REAL NOT NULL,
-            payment_id TEXT UNIQUE,
-            status TEXT DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (product_id) REFERENCES products (id)
-        )
-    """)
-    
-    # Таблица пользователей
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    conn.commit()
-    conn.close()
+    """Инициализация базы данных (применение миграций схемы)"""
+    with get_connection() as conn:
+        apply_migrations(conn)
 
 # === ТОВАРЫ ===
 
+def stock_hash(content: str) -> int:
+    """64-битный хэш единицы стока (для индекса дубликатов)"""
+    digest = hashlib.blake2b(content.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+def parse_stock_lines(text: str) -> List[str]:
+    """Разбить текст на единицы товара (по одной на строку)"""
+    return [line.strip() for line in text.split('\n') if line.strip()]
+
 def add_product(name: str, description: str, price: float, stock: str = "", product_type: str = "text") -> int:
     """Добавить товар"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO products (name, description, price, stock, product_type) VALUES (?, ?, ?, ?, ?)",
-        (name, description, price, stock, product_type)
-    )
-    product_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return product_id
-
-def get_all_products() -> List[Dict]:
-    """Получить все товары"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM products ORDER BY id")
-    products = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return products
+    if product_type == 'file':
+        items = [stock] if stock else []
+    else:
+        items = parse_stock_lines(stock) if stock else []
+    
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO products (name, description, price, product_type) VALUES (?, ?, ?, ?)",
+            (name, description, price, product_type)
+        )
+        product_id = cursor.lastrowid
+        cursor.executemany(
+            INSERT_STOCK_ITEM_SQL,
+            ((product_id, item, stock_hash(item)) for item in items)
+        )
+        return product_id
 
 def get_product(product_id: int) -> Optional[Dict]:
     """Получить товар по ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT {PRODUCT_COLUMNS}, {STOCK_COUNT_SQL} AS stock_count FROM products WHERE id = ?",
+            (product_id,)
+        )
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+def get_products_page(cursor: int = 0, direction: str = 'next', limit: int = 10,
+                      with_stock: bool = False) -> Dict:
+    """
+    Страница товаров (keyset-пагинация по id)
+    
+    Args:
+        cursor: id, от которого листать (0 - первая страница)
+        direction: 'next' - товары с id > cursor, 'prev' - с id < cursor
+        limit: размер страницы
+        with_stock: добавить stock_count (для админки)
+    
+    Returns:
+        dict со списком товаров (только поля для кнопок) и флагами has_prev/has_next
+    """
+    columns = "id, name, price, product_type"
+    if with_stock:
+        columns += f", {STOCK_COUNT_SQL} AS stock_count"
+    
+    with get_connection() as conn:
+        rows = []
+        if direction == 'prev' and cursor:
+            rows = conn.execute(
+                f"SELECT {columns} FROM products WHERE id < ? ORDER BY id DESC LIMIT ?",
+                (cursor, limit)
+            ).fetchall()[::-1]
+        
+        if not rows:
+            # Листаем вперёд; если предыдущих товаров уже нет - с начала
+            after_id = cursor if direction == 'next' else 0
+            rows = conn.execute(
+                f"SELECT {columns} FROM products WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, limit)
+            ).fetchall()
+        
+        products = [dict(row) for row in rows]
+        has_prev = has_next = False
+        if products:
+            has_prev = bool(conn.execute(
+                "SELECT EXISTS(SELECT 1 FROM products WHERE id < ?)", (products[0]['id'],)
+            ).fetchone()[0])
+            has_next = bool(conn.execute(
+                "SELECT EXISTS(SELECT 1 FROM products WHERE id > ?)", (products[-1]['id'],)
+            ).fetchone()[0])
+    
+    return {'products': products, 'has_prev': has_prev, 'has_next': has_next}
+
+def search_query(text: str) -> str:
+    """
+    Выражение MATCH для FTS5 из пользовательского запроса
+    
+    Каждое слово ищется как префикс, все слова должны встретиться.
+    Кавычки экранируют спецсимволы FTS5. Пустая строка - искать нечего.
+    """
+    words = re.findall(r"\w+", text.lower())
+    return " ".join(f'"{word}"*' for word in words)
+
+def search_products(query: str, limit: int = 20, offset: int = 0) -> List[Dict]:
+    """
+    Полнотекстовый поиск товаров по названию и описанию
+    
+    Args:
+        query: выражение из search_query()
+    
+    Returns:
+        товары с количеством в наличии, самые релевантные первыми
+        (совпадение в названии весит больше, чем в описании)
+    """
+    if not query:
+        return []
+    with get_connection() as conn:
+        cursor = conn.execute(
+            f"""SELECT {PRODUCT_COLUMNS}, {STOCK_COUNT_SQL} AS stock_count
+                FROM (
+                    SELECT rowid, bm25(products_fts, 10.0, 1.0) AS score
+                    FROM products_fts WHERE products_fts MATCH ?
+                    ORDER BY score LIMIT ? OFFSET ?
+                ) AS found
+                JOIN products ON products.id = found.rowid
+                ORDER BY found.score""",
+            (query, limit, offset)
+        )
+        return [dict(row) for row in cursor.fetchall()]
 
 def update_product(product_id: int, name: str = None, description: str = None, 
-                   price: float = None, stock: str = None, product_type: str = None):
+                   price: float = None, product_type: str = None):
     """Обновить товар"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
     updates = []
     params = []
     
@@ -108,134 +193,640 @@ def update_product(product_id: int, name: str = None, description: str = None,
     if price is not None:
         updates.append("price = ?")
         params.append(price)
-    if stock is not None:
-        updates.append("stock = ?")
-        params.append(stock)
     if product_type is not None:
         updates.append("product_type = ?")
         params.append(product_type)
     
-    if updates:
-        params.append(product_id)
-        query = f"UPDATE products SET {', '.join(updates)} WHERE id = ?"
-        cursor.execute(query, params)
-        conn.commit()
+    if not updates:
+        return
     
-    conn.close()
+    params.append(product_id)
+    query = f"UPDATE products SET {', '.join(updates)} WHERE id = ?"
+    with get_connection() as conn:
+        conn.execute(query, params)
 
 def delete_product(product_id: int):
     """Удалить товар"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute("DELETE FROM stock_items WHERE product_id = ? AND order_id IS NULL", (product_id,))
+        conn.execute("DELETE FROM products WHERE id = ?", (product_id,))
 
-def get_stock_item(product_id: int) -> Optional[str]:
-    """Получить один товар из стока"""
-    product = get_product(product_id)
-    if not product or not product['stock']:
-        return None
+def add_stock_items(product_id: int, items: Iterable[str]) -> int:
+    """
+    Добавить единицы товара в сток
     
-    stock_lines = product['stock'].strip().split('\n')
-    if not stock_lines or stock_lines[0] == '':
-        return None
+    Единицы, которые у товара уже есть (в том числе проданные), пропускаются.
     
-    item = stock_lines[0]
-    remaining_stock = '\n'.join(stock_lines[1:])
-    
-    update_product(product_id, stock=remaining_stock)
-    return item
+    Returns:
+        количество добавленных единиц
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            INSERT_STOCK_ITEM_SQL,
+            ((product_id, item, stock_hash(item)) for item in items)
+        )
+        return cursor.rowcount
 
-# === ЗАКАЗЫ ===
+def replace_stock(product_id: int, item: str):
+    """Заменить весь свободный сток одной единицей (для файловых товаров)"""
+    with get_connection() as conn:
+        conn.execute("DELETE FROM stock_items WHERE product_id = ? AND order_id IS NULL", (product_id,))
+        conn.execute(
+            "INSERT INTO stock_items (product_id, content, content_hash) VALUES (?, ?, ?)",
+            (product_id, item, stock_hash(item))
+        )
+
+def get_stock_count(product_id: int) -> int:
+    """Количество непроданных единиц товара"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT COUNT(*) FROM stock_items WHERE product_id = ? AND order_id IS NULL",
+            (product_id,)
+        )
+        return cursor.fetchone()[0]
+
+# Помощники ниже работают на переданном соединении: составные операции
+# (резерв заказа, отмена, выдача) вызывают их внутри своей транзакции.
+
+def _claim_stock_items(conn, product_id: int, order_id: int, quantity: int) -> List[str]:
+    cursor = conn.execute(
+        """UPDATE stock_items SET order_id = ?, claimed_at = CURRENT_TIMESTAMP
+           WHERE id IN (
+               SELECT id FROM stock_items
+               WHERE product_id = ? AND order_id IS NULL
+               ORDER BY id LIMIT ?
+           )
+           RETURNING content""",
+        (order_id, product_id, quantity)
+    )
+    return [row['content'] for row in cursor.fetchall()]
+
+def _reserve_stock_items(conn, product_id: int, order_id: int, quantity: int, ttl_seconds: int) -> int:
+    cursor = conn.execute(
+        """UPDATE stock_items SET order_id = ?, reserved_until = datetime('now', ?)
+           WHERE id IN (
+               SELECT id FROM stock_items
+               WHERE product_id = ? AND order_id IS NULL
+               ORDER BY id LIMIT ?
+           )""",
+        (order_id, f"{int(ttl_seconds):+d} seconds", product_id, quantity)
+    )
+    return cursor.rowcount
+
+def _confirm_reserved_items(conn, order_id: int) -> List[str]:
+    cursor = conn.execute(
+        """UPDATE stock_items SET reserved_until = NULL, claimed_at = CURRENT_TIMESTAMP
+           WHERE order_id = ? AND claimed_at IS NULL
+           RETURNING content""",
+        (order_id,)
+    )
+    return [row['content'] for row in cursor.fetchall()]
 
-def create_order(user_id: int, username: str, product_id: int, 
-                 product_name: str, price: float, payment_id: str) -> int:
-    """Создать заказ"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """INSERT INTO orders (user_id, username, product_id, product_name, price, payment_id)
-           VALUES (?, ?, ?, ?, ?, ?)""",
-        (user_id, username, product_id, product_name, price, payment_id)
+def _claimed_items(conn, order_id: int) -> List[str]:
+    cursor = conn.execute(
+        "SELECT content FROM stock_items WHERE order_id = ? AND claimed_at IS NOT NULL ORDER BY id",
+        (order_id,)
     )
-    order_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return order_id
+    return [row['content'] for row in cursor.fetchall()]
+
+def _release_reservations(conn, order_id: int) -> int:
+    cursor = conn.execute(
+        """UPDATE stock_items SET order_id = NULL, reserved_until = NULL
+           WHERE order_id = ? AND claimed_at IS NULL""",
+        (order_id,)
+    )
+    return cursor.rowcount
+
+def release_expired_reservations(limit: int = 500) -> int:
+    """Вернуть в сток пачку просроченных резервов, возвращает их количество"""
+    with get_connection() as conn:
+        cursor = conn.execute(
+            """UPDATE stock_items SET order_id = NULL, reserved_until = NULL
+               WHERE id IN (
+                   SELECT id FROM stock_items
+                   WHERE reserved_until IS NOT NULL AND reserved_until < datetime('now')
+                   LIMIT ?
+               )""",
+            (limit,)
+        )
+        return cursor.rowcount
+
+# === ЗАКАЗЫ ===
+
+def reserve_order(user_id: int, username: str, product_id: int, product_name: str,
+                  price: float, ttl_seconds: int, quantity: int = 1) -> Optional[int]:
+    """
+    Создать заказ (ещё без платежа) и зарезервировать под него quantity единиц товара
+    
+    Резервы прошлых неоплаченных заказов пользователя на этот товар снимаются:
+    у пользователя на товар держится не больше одного резерва. Сами заказы
+    остаются в ожидании - если их всё же оплатят, товар выдаётся из свободного стока.
+    
+    Args:
+        price: сумма всего заказа (цена × количество)
+    
+    Returns:
+        ID заказа или None, если свободного стока не хватает
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SAVEPOINT reserve_order")
+        cursor.execute(
+            """UPDATE stock_items SET order_id = NULL, reserved_until = NULL
+               WHERE claimed_at IS NULL AND order_id IN (
+                   SELECT id FROM orders WHERE user_id = ? AND product_id = ? AND status = ?
+               )""",
+            (user_id, product_id, ORDER_PENDING)
+        )
+        cursor.execute(
+            """INSERT INTO orders (user_id, username, product_id, product_name, price, quantity)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (user_id, username, product_id, product_name, price, quantity)
+        )
+        order_id = cursor.lastrowid
+        if _reserve_stock_items(conn, product_id, order_id, quantity, ttl_seconds) < quantity:
+            cursor.execute("ROLLBACK TO reserve_order")
+            cursor.execute("RELEASE reserve_order")
+            return None
+        cursor.execute("RELEASE reserve_order")
+        return order_id
+
+def attach_payment(order_id: int, payment_id: str, payment_url: str = None):
+    """Привязать платёж (и ссылку на оплату) к заказу"""
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE orders SET payment_id = ?, payment_url = ? WHERE id = ?",
+            (payment_id, payment_url, order_id)
+        )
+
+def get_active_order(user_id: int, product_id: int) -> Optional[Dict]:
+    """Неоплаченный заказ пользователя на товар, резерв которого ещё действует"""
+    with get_connection() as conn:
+        row = conn.execute(
+            """SELECT o.* FROM orders o
+               WHERE o.user_id = ? AND o.product_id = ? AND o.status = ?
+                 AND o.payment_id IS NOT NULL
+                 AND EXISTS (
+                     SELECT 1 FROM stock_items s
+                     WHERE s.order_id = o.id AND s.reserved_until > datetime('now')
+                 )
+               ORDER BY o.id DESC LIMIT 1""",
+            (user_id, product_id, ORDER_PENDING)
+        ).fetchone()
+        return dict(row) if row else None
+
+def cancel_order(order_id: int, user_id: int = None) -> bool:
+    """Отменить неоплаченный заказ и снять резерв (с user_id - только заказ этого пользователя)"""
+    with get_connection() as conn:
+        cursor = conn.execute(
+            """UPDATE orders SET status = 'canceled'
+               WHERE id = ? AND status = ? AND (? IS NULL OR user_id = ?)""",
+            (order_id, ORDER_PENDING, user_id, user_id)
+        )
+        if cursor.rowcount == 0:
+            return False
+        _release_reservations(conn, order_id)
+        return True
 
 def get_order_by_payment(payment_id: str) -> Optional[Dict]:
     """Получить заказ по ID платежа"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM orders WHERE payment_id = ?", (payment_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
-
-def update_order_status(payment_id: str, status: str):
-    """Обновить статус заказа"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE orders SET status = ? WHERE payment_id = ?",
-        (status, payment_id)
-    )
-    conn.commit()
-    conn.close()
-
-def get_all_orders() -> List[Dict]:
-    """Получить все заказы"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM orders ORDER BY created_at DESC")
-    orders = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return orders
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM orders WHERE payment_id = ?", (payment_id,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+def update_order_status(payment_id: str, status: str, from_status: str = None) -> bool:
+    """
+    Обновить статус заказа (если задан from_status - только из этого статуса)
+    
+    При отмене или истечении заказа его резерв возвращается в сток.
+    """
+    with get_connection() as conn:
+        if from_status is None:
+            cursor = conn.execute(
+                "UPDATE orders SET status = ? WHERE payment_id = ? RETURNING id",
+                (status, payment_id)
+            )
+        else:
+            cursor = conn.execute(
+                "UPDATE orders SET status = ? WHERE payment_id = ? AND status = ? RETURNING id",
+                (status, payment_id, from_status)
+            )
+        rows = cursor.fetchall()
+        if status in ('canceled', 'expired'):
+            for row in rows:
+                _release_reservations(conn, row['id'])
+        return len(rows) > 0
+
+def begin_fulfillment(payment_id: str) -> Dict:
+    """
+    Начать выдачу оплаченного заказа
+    
+    В одной транзакции: переводит заказ в fulfilling условным UPDATE,
+    закрепляет за ним все единицы стока заказа и учитывает продажу в агрегатах.
+    Если стока нет - заказ переходит в failed (повторная проверка оплаты
+    попробует снова). Заказ, ушедший в failed после неудачных доставок,
+    получает уже закреплённые за ним единицы, а не новые. Уже выдаваемый
+    или выданный заказ не трогается, поэтому вызывать можно параллельно.
+    
+    Returns:
+        dict: status (CLAIMED и др.), order, product (id, name, product_type),
+        items - выданные единицы (по количеству в заказе)
+    """
+    result = {'status': None, 'order': None, 'product': None, 'items': []}
+    
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """SELECT o.*, p.product_type FROM orders o
+               LEFT JOIN products p ON p.id = o.product_id
+               WHERE o.payment_id = ?""",
+            (payment_id,)
+        )
+        row = cursor.fetchone()
+        if not row:
+            result['status'] = ORDER_NOT_FOUND
+            return result
+        
+        order = dict(row)
+        product_type = order.pop('product_type')
+        result['order'] = order
+        
+        if order['status'] == ORDER_DELIVERED:
+            result['status'] = ALREADY_DELIVERED
+            return result
+        if order['status'] == ORDER_FULFILLING:
+            result['status'] = IN_PROGRESS
+            return result
+        if product_type is None:
+            result['status'] = PRODUCT_NOT_FOUND
+            return result
+        
+        result['product'] = {
+            'id': order['product_id'],
+            'name': order['product_name'],
+            'product_type': product_type
+        }
+        
+        cursor.execute(
+            """UPDATE orders SET status = ?, fulfilling_since = CURRENT_TIMESTAMP
+               WHERE id = ? AND status = ?""",
+            (ORDER_FULFILLING, order['id'], order['status'])
+        )
+        if cursor.rowcount == 0:
+            result['status'] = IN_PROGRESS
+            return result
+        
+        # Сначала резерв, сделанный при покупке; если он (частично) истёк -
+        # недостающее из свободного стока. Выдаётся всё количество или ничего.
+        cursor.execute("SAVEPOINT claim_items")
+        claimed_before = _claimed_items(conn, order['id'])
+        items = claimed_before + _confirm_reserved_items(conn, order['id'])
+        missing = order['quantity'] - len(items)
+        if missing > 0:
+            items += _claim_stock_items(conn, order['product_id'], order['id'], missing)
+        if len(items) < order['quantity']:
+            cursor.execute("ROLLBACK TO claim_items")
+            cursor.execute("RELEASE claim_items")
+            _release_reservations(conn, order['id'])
+            cursor.execute("UPDATE orders SET status = ? WHERE id = ?", (ORDER_FAILED, order['id']))
+            order['status'] = ORDER_FAILED
+            result['status'] = OUT_OF_STOCK
+            return result
+        cursor.execute("RELEASE claim_items")
+        
+        if not claimed_before:
+            record_sale(cursor, order['product_name'], order['price'])
+        order['status'] = ORDER_FULFILLING
+        result['items'] = items
+        result['status'] = CLAIMED
+        return result
+
+def complete_fulfillment(order_id: int) -> bool:
+    """Отметить заказ выданным (fulfilling -> delivered)"""
+    with get_connection() as conn:
+        cursor = conn.execute(
+            "UPDATE orders SET status = ? WHERE id = ? AND status = ?",
+            (ORDER_DELIVERED, order_id, ORDER_FULFILLING)
+        )
+        return cursor.rowcount > 0
+
+def get_stale_fulfillments(older_than_seconds: int, limit: int = 100, after_id: int = 0) -> List[Dict]:
+    """
+    Заказы, застрявшие в fulfilling (например, бот упал до отправки товара),
+    пачкой с id больше after_id
+    
+    Зависание считается от последнего перехода в fulfilling, а не от
+    закрепления стока: заказ, снова взятый в выдачу кнопкой, не подхватывается
+    сверкой, пока его отправляет хендлер.
+    
+    Returns:
+        заказы с закреплёнными единицами стока (items) и типом товара
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """SELECT o.*, json_group_array(s.content) AS items, p.product_type
+               FROM orders o
+               JOIN stock_items s ON s.order_id = o.id AND s.claimed_at IS NOT NULL
+               LEFT JOIN products p ON p.id = o.product_id
+               WHERE o.status = ? AND o.id > ? AND o.fulfilling_since <= datetime('now', ?)
+               GROUP BY o.id
+               ORDER BY o.id LIMIT ?""",
+            (ORDER_FULFILLING, after_id, f"-{int(older_than_seconds)} seconds", limit)
+        )
+        orders = []
+        for row in cursor.fetchall():
+            order = dict(row)
+            order['items'] = json.loads(order['items'])
+            orders.append(order)
+        return orders
+
+def record_delivery_failure(order_id: int, max_attempts: int) -> bool:
+    """
+    Учесть неудачную повторную доставку заказа
+    
+    Returns:
+        True, если попытки исчерпаны и заказ переведён в failed
+    """
+    with get_connection() as conn:
+        row = conn.execute(
+            """UPDATE orders SET delivery_attempts = delivery_attempts + 1,
+                   status = CASE WHEN delivery_attempts + 1 >= ? THEN ? ELSE status END
+               WHERE id = ? AND status = ?
+               RETURNING status""",
+            (max_attempts, ORDER_FAILED, order_id, ORDER_FULFILLING)
+        ).fetchone()
+        return row is not None and row['status'] == ORDER_FAILED
+
+def get_pending_orders(after_id: int = 0, limit: int = 100, min_age_seconds: int = 0) -> List[Dict]:
+    """Получить пачку неоплаченных заказов старше min_age_seconds (keyset по id)"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """SELECT * FROM orders
+               WHERE status = 'pending' AND id > ? AND payment_id IS NOT NULL
+                 AND created_at <= datetime('now', ?)
+               ORDER BY id LIMIT ?""",
+            (after_id, f"-{int(min_age_seconds)} seconds", limit)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_closed_unpaid_orders(after_id: int = 0, limit: int = 100, max_age_hours: int = 24) -> List[Dict]:
+    """
+    Отменённые и просроченные заказы, платёж которых в ЮKassa ещё открыт
+    (payment_url не сброшен), моложе max_age_hours (keyset по id)
+    
+    Отмена заказа не отменяет платёж: если его всё же оплатят, сверка выдаст товар.
+    """
+    with get_connection() as conn:
+        cursor = conn.execute(
+            """SELECT * FROM orders
+               WHERE status IN ('canceled', 'expired') AND created_at >= datetime('now', ?)
+                 AND id > ? AND payment_url IS NOT NULL
+               ORDER BY id LIMIT ?""",
+            (f"-{int(max_age_hours)} hours", after_id, limit)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+def close_payment_link(payment_id: str):
+    """Платёж в ЮKassa окончательно отменён - ссылка на оплату больше не действует"""
+    with get_connection() as conn:
+        conn.execute("UPDATE orders SET payment_url = NULL WHERE payment_id = ?", (payment_id,))
+
+def get_recent_orders(limit: int = 10, before_cursor: int = None, status: str = None,
+                      user_id: int = None) -> List[Dict]:
+    """
+    Последние заказы (keyset-пагинация по created_at, id)
+    
+    Args:
+        limit: сколько заказов вернуть
+        before_cursor: id последнего заказа предыдущей страницы
+        status: фильтр по статусу
+        user_id: фильтр по покупателю
+    """
+    conditions = []
+    params = []
+    
+    if status is not None:
+        conditions.append("status = ?")
+        params.append(status)
+    if user_id is not None:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    if before_cursor is not None:
+        conditions.append("(created_at, id) < (SELECT created_at, id FROM orders WHERE id = ?)")
+        params.append(before_cursor)
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    params.append(limit)
+    
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT * FROM orders {where} ORDER BY created_at DESC, id DESC LIMIT ?",
+            params
+        )
+        return [dict(row) for row in cursor.fetchall()]
 
 def get_orders_stats() -> Dict:
-    """Получить статистику заказов"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Общая выручка
-    cursor.execute("SELECT SUM(price) FROM orders WHERE status = 'paid'")
-    total_revenue = cursor.fetchone()[0] or 0
-    
-    # Количество заказов
-    cursor.execute("SELECT COUNT(*) FROM orders WHERE status = 'paid'")
-    total_orders = cursor.fetchone()[0]
-    
-    # Популярные товары
-    cursor.execute("""
-        SELECT product_name, COUNT(*) as count, SUM(price) as revenue
-        FROM orders 
-        WHERE status = 'paid'
-        GROUP BY product_name
-        ORDER BY count DESC
-        LIMIT 5
-    """)
-    top_products = [dict(row) for row in cursor.fetchall()]
-    
-    conn.close()
+    """Получить статистику заказов (из агрегатов продаж)"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Общая выручка и количество заказов
+        cursor.execute("SELECT orders_count, revenue FROM sales_totals WHERE id = 1")
+        row = cursor.fetchone()
+        total_orders = row['orders_count'] if row else 0
+        total_revenue = row['revenue'] if row else 0
+        
+        # Популярные товары
+        cursor.execute("""
+            SELECT product_name, orders_count as count, revenue
+            FROM sales_by_product
+            ORDER BY orders_count DESC
+            LIMIT 5
+        """)
+        top_products = [dict(row) for row in cursor.fetchall()]
+        
+        # Продажи за последние дни (сегодня = 1 день)
+        periods = {}
+        for key, days in (('today', 1), ('week', 7), ('month', 30)):
+            cursor.execute(
+                """SELECT COALESCE(SUM(orders_count), 0), COALESCE(SUM(revenue), 0)
+                   FROM sales_by_day WHERE day >= date('now', ?)""",
+                (f"-{days - 1} days",)
+            )
+            count, revenue = cursor.fetchone()
+            periods[key] = {'orders': count, 'revenue': revenue}
     
     return {
         'total_revenue': total_revenue,
         'total_orders': total_orders,
-        'top_products': top_products
+        'top_products': top_products,
+        'periods': periods
     }
 
 # === ПОЛЬЗОВАТЕЛИ ===
 
-def add_user(user_id: int, username: str = None, first_name: str = None, 
-             last_name: str = None):
-    """Добавить пользователя"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
-           VALUES (?, ?, ?, ?)""",
-        (user_id, username, first_name, last_name)
-    )
-    conn.commit()
-    conn.close()
\ No newline at end of file
+def upsert_users(users: List[tuple]):
+    """
+    Добавить пользователей пачкой или обновить изменившиеся профили
+    
+    Args:
+        users: кортежи (user_id, username, first_name, last_name)
+    """
+    with get_connection() as conn:
+        conn.executemany(
+            """INSERT INTO users (user_id, username, first_name, last_name)
+               VALUES (?, ?, ?, ?)
+               ON CONFLICT (user_id) DO UPDATE SET
+                   username = excluded.username,
+                   first_name = excluded.first_name,
+                   last_name = excluded.last_name,
+                   blocked = 0
+               WHERE username IS NOT excluded.username
+                  OR first_name IS NOT excluded.first_name
+                  OR last_name IS NOT excluded.last_name
+                  OR blocked""",
+            users
+        )
+
+def get_user_ids_page(after_id: int = 0, limit: int = 1000) -> List[int]:
+    """Страница ID активных (не заблокировавших бота) пользователей по возрастанию"""
+    with get_connection() as conn:
+        rows = conn.execute(
+            """SELECT user_id FROM users
+               WHERE user_id > ? AND blocked = 0
+               ORDER BY user_id LIMIT ?""",
+            (after_id, limit)
+        ).fetchall()
+        return [row['user_id'] for row in rows]
+
+def get_users_count() -> int:
+    """Количество активных пользователей"""
+    with get_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM users WHERE blocked = 0").fetchone()[0]
+
+def mark_users_blocked(user_ids: List[int]):
+    """Отметить пользователей, заблокировавших бота"""
+    with get_connection() as conn:
+        conn.executemany("UPDATE users SET blocked = 1 WHERE user_id = ?", [(user_id,) for user_id in user_ids])
+
+# === РАССЫЛКИ ===
+
+def create_broadcast(from_chat_id: int, message_id: int) -> int:
+    """Создать рассылку копии сообщения (сразу в статусе running)"""
+    with get_connection() as conn:
+        cursor = conn.execute(
+            "INSERT INTO broadcasts (from_chat_id, message_id) VALUES (?, ?)",
+            (from_chat_id, message_id)
+        )
+        return cursor.lastrowid
+
+def get_broadcast(broadcast_id: int) -> Optional[Dict]:
+    """Рассылка по ID"""
+    with get_connection() as conn:
+        row = conn.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+        return dict(row) if row else None
+
+def get_latest_broadcast() -> Optional[Dict]:
+    """Последняя созданная рассылка"""
+    with get_connection() as conn:
+        row = conn.execute("SELECT * FROM broadcasts ORDER BY id DESC LIMIT 1").fetchone()
+        return dict(row) if row else None
+
+def get_running_broadcast() -> Optional[Dict]:
+    """Самая старая незавершённая рассылка"""
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id LIMIT 1"
+        ).fetchone()
+        return dict(row) if row else None
+
+def save_broadcast_progress(broadcast_id: int, last_user_id: int, sent: int, failed: int,
+                            blocked: int):
+    """Сохранить позицию рассылки и прибавить счётчики пачки"""
+    with get_connection() as conn:
+        conn.execute(
+            """UPDATE broadcasts SET
+                   last_user_id = ?, sent = sent + ?, failed = failed + ?, blocked = blocked + ?
+               WHERE id = ?""",
+            (last_user_id, sent, failed, blocked, broadcast_id)
+        )
+
+def finish_broadcast(broadcast_id: int, status: str = 'done') -> bool:
+    """Завершить рассылку (done/canceled), если она ещё идёт"""
+    with get_connection() as conn:
+        cursor = conn.execute(
+            """UPDATE broadcasts SET status = ?, finished_at = CURRENT_TIMESTAMP
+               WHERE id = ? AND status = 'running'""",
+            (status, broadcast_id)
+        )
+        return cursor.rowcount > 0
+
+# === СОСТОЯНИЯ FSM ===
+
+def get_fsm_record(key: str) -> Optional[Dict]:
+    """Состояние и данные FSM по ключу (data - JSON-строка)"""
+    with get_connection() as conn:
+        row = conn.execute("SELECT state, data FROM fsm_states WHERE key = ?", (key,)).fetchone()
+        return dict(row) if row else None
+
+def save_fsm_records(records: List[tuple]):
+    """
+    Записать состояния FSM пачкой
+    
+    Args:
+        records: кортежи (key, state, data), data - JSON-строка;
+            запись без состояния и с пустыми данными удаляется
+    """
+    with get_connection() as conn:
+        empty = [(key,) for key, state, data in records if state is None and data == '{}']
+        filled = [record for record in records if record[1] is not None or record[2] != '{}']
+        if empty:
+            conn.executemany("DELETE FROM fsm_states WHERE key = ?", empty)
+        if filled:
+            conn.executemany(
+                """INSERT INTO fsm_states (key, state, data) VALUES (?, ?, ?)
+                   ON CONFLICT (key) DO UPDATE SET
+                       state = excluded.state,
+                       data = excluded.data,
+                       updated_at = CURRENT_TIMESTAMP""",
+                filled
+            )
+
+def delete_stale_fsm_records(ttl_seconds: int) -> int:
+    """Удалить состояния FSM, не менявшиеся дольше ttl_seconds"""
+    with get_connection() as conn:
+        cursor = conn.execute(
+            "DELETE FROM fsm_states WHERE updated_at < datetime('now', ?)",
+            (f"-{int(ttl_seconds)} seconds",)
+        )
+        return cursor.rowcount
+
+# === ВЕРСИИ КЭШЕЙ ===
+
+def get_cache_version(name: str) -> int:
+    """Общая (между процессами) версия кэша"""
+    with get_connection() as conn:
+        row = conn.execute("SELECT version FROM cache_versions WHERE name = ?", (name,)).fetchone()
+        return row['version'] if row else 0
+
+def bump_cache_version(name: str) -> int:
+    """Увеличить общую версию кэша, возвращает новую"""
+    with get_connection() as conn:
+        row = conn.execute(
+            """INSERT INTO cache_versions (name, version) VALUES (?, 1)
+               ON CONFLICT (name) DO UPDATE SET version = version + 1
+               RETURNING version""",
+            (name,)
+        ).fetchone()
+        return row['version']
+
+
+# Замер времени всех функций работы с БД (чистые хелперы без запросов не нужны)
+instrument_module(globals(), __name__, exclude={'get_connection', 'parse_stock_lines', 'stock_hash', 'search_query'})
@@ -0,0 +1,79 @@
+import asyncio
+import queue
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Optional
+
+from config import DATABASE_PATH, DB_POOL_SIZE, DB_MMAP_SIZE, DB_BUSY_TIMEOUT
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Открыть соединение с настройками для конкурентной работы (WAL)"""
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=DB_BUSY_TIMEOUT / 1000)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT}")
+    return conn
+
+
+class ConnectionPool:
+    """Ограниченный пул долгоживущих соединений SQLite.
+
+    Запросы выполняются в отдельном пуле потоков, поэтому обращения к БД
+    не блокируют event loop бота.
+    """
+
+    def __init__(self, path: str, size: int = 4):
+        self.path = path
+        self.size = size
+        self._connections = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._connections.put(connect(path))
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="db")
+
+    @contextmanager
+    def connection(self):
+        """Взять соединение из пула (commit при успехе, rollback при ошибке)"""
+        conn = self._connections.get()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._connections.put(conn)
+
+    async def run(self, func, *args, **kwargs):
+        """Выполнить синхронную функцию работы с БД в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    def close(self):
+        """Закрыть все соединения пула"""
+        self._executor.shutdown(wait=True)
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+
+_pool: Optional[ConnectionPool] = None
+
+
+def get_pool() -> ConnectionPool:
+    """Получить (и при необходимости создать) пул соединений"""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(DATABASE_PATH, DB_POOL_SIZE)
+    return _pool
+
+
+def close_pool():
+    """Закрыть пул соединений"""
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
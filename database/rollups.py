@@ -0,0 +1,108 @@
+"""Агрегаты продаж для статистики.
+
+Таблицы sales_totals, sales_by_product и sales_by_day обновляются в той же
+транзакции, что закрепляет за оплаченным заказом единицу стока, поэтому экран статистики
+читает несколько строк вместо полного прохода по orders.
+
+Заполнить агрегаты по уже существующим заказам:
+
+    python -m database.rollups
+"""
+import sqlite3
+
+ROLLUP_TABLES = ("sales_totals", "sales_by_product", "sales_by_day")
+
+# Статусы оплаченных заказов (paid - до перехода на fulfilling/delivered)
+SALE_STATUSES = "('paid', 'fulfilling', 'delivered')"
+
+# Продажи так, как их учитывает record_sale: заказы, за которыми закреплён
+# сток (в том числе ушедшие в failed после неудачной доставки), по дню
+# первого закрепления; старые заказы без строк стока - по статусу и дню создания
+SALES_CTE = f"""
+    WITH claims AS (
+        SELECT order_id, date(MIN(claimed_at)) AS day FROM stock_items
+        WHERE order_id IS NOT NULL AND claimed_at IS NOT NULL
+        GROUP BY order_id
+    ),
+    sales AS (
+        SELECT o.product_name, o.price, COALESCE(c.day, date(o.created_at)) AS day
+        FROM orders o LEFT JOIN claims c ON c.order_id = o.id
+        WHERE c.order_id IS NOT NULL OR o.status IN {SALE_STATUSES}
+    )
+"""
+
+def create_rollup_tables(cursor: sqlite3.Cursor):
+    """Создать таблицы агрегатов"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sales_totals (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            orders_count INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sales_by_product (
+            product_name TEXT PRIMARY KEY,
+            orders_count INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sales_by_day (
+            day TEXT PRIMARY KEY,
+            orders_count INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0
+        )
+    """)
+
+
+def record_sale(cursor: sqlite3.Cursor, product_name: str, price: float, day: str = None):
+    """Учесть оплаченный заказ в агрегатах (вызывать в транзакции смены статуса)"""
+    cursor.execute(
+        """INSERT INTO sales_totals (id, orders_count, revenue) VALUES (1, 1, ?)
+           ON CONFLICT (id) DO UPDATE SET orders_count = orders_count + 1,
+                                          revenue = revenue + excluded.revenue""",
+        (price,)
+    )
+    cursor.execute(
+        """INSERT INTO sales_by_product (product_name, orders_count, revenue) VALUES (?, 1, ?)
+           ON CONFLICT (product_name) DO UPDATE SET orders_count = orders_count + 1,
+                                                    revenue = revenue + excluded.revenue""",
+        (product_name, price)
+    )
+    cursor.execute(
+        """INSERT INTO sales_by_day (day, orders_count, revenue) VALUES (COALESCE(?, date('now')), 1, ?)
+           ON CONFLICT (day) DO UPDATE SET orders_count = orders_count + 1,
+                                           revenue = revenue + excluded.revenue""",
+        (day, price)
+    )
+
+
+def backfill(cursor: sqlite3.Cursor):
+    """Пересчитать агрегаты по всем оплаченным заказам"""
+    for table in ROLLUP_TABLES:
+        cursor.execute(f"DELETE FROM {table}")
+    
+    cursor.execute(f"""
+        {SALES_CTE}
+        INSERT INTO sales_totals (id, orders_count, revenue)
+        SELECT 1, COUNT(*), COALESCE(SUM(price), 0) FROM sales
+    """)
+    cursor.execute(f"""
+        {SALES_CTE}
+        INSERT INTO sales_by_product (product_name, orders_count, revenue)
+        SELECT product_name, COUNT(*), SUM(price) FROM sales GROUP BY product_name
+    """)
+    cursor.execute(f"""
+        {SALES_CTE}
+        INSERT INTO sales_by_day (day, orders_count, revenue)
+        SELECT day, COUNT(*), SUM(price) FROM sales GROUP BY day
+    """)
+
+if __name__ == "__main__":
+    from database.models import init_db, get_connection
+    
+    init_db()
+    with get_connection() as conn:
+        backfill(conn.cursor())
+    print("Агрегаты продаж пересчитаны")
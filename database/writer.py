@@ -0,0 +1,180 @@
+"""Единственный писатель в БД с групповыми коммитами.
+
+Все изменения данных выполняются в отдельном потоке на одном соединении.
+Записи, накопившиеся за короткое окно (DB_WRITE_BATCH_WINDOW), попадают
+в одну транзакцию: один fsync на пачку вместо одного на каждую запись.
+Каждая запись выполняется в своём SAVEPOINT, поэтому ошибка одной не
+откатывает остальные. Future, возвращаемый submit, разрешается после
+COMMIT пачки.
+
+Если с той же БД работают другие процессы бота, BEGIN IMMEDIATE может
+не дождаться блокировки за busy_timeout - тогда захват повторяется
+с растущей паузой (DB_LOCK_RETRIES раз), прежде чем пачка завершится ошибкой.
+"""
+import asyncio
+import logging
+import queue
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from config import DATABASE_PATH, DB_WRITE_BATCH_WINDOW, DB_WRITE_BATCH_SIZE, DB_LOCK_RETRIES
+from database.pool import connect
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+# Соединение писателя, пока в этом потоке выполняется запись
+_local = threading.local()
+
+
+@contextmanager
+def _current_transaction(conn):
+    yield conn
+
+
+def current_write_connection():
+    """Контекстный менеджер соединения писателя, если вызов идёт из пачки записей"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return None
+    return _current_transaction(conn)
+
+
+class _Job:
+    __slots__ = ('func', 'args', 'kwargs', 'loop', 'future')
+
+    def __init__(self, func, args, kwargs, loop, future):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.loop = loop
+        self.future = future
+
+
+def _resolve(future: asyncio.Future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class WriteQueue:
+    """Очередь записей с отдельным потоком-писателем"""
+
+    def __init__(self, path: str, window: float = 0.002, max_batch: int = 256,
+                 lock_retries: int = 5):
+        self.path = path
+        self.window = window
+        self.max_batch = max_batch
+        self.lock_retries = lock_retries
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    async def submit(self, func, *args, **kwargs):
+        """Поставить запись в очередь и дождаться её коммита"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put(_Job(func, args, kwargs, loop, future))
+        return await future
+
+    def _collect(self, first) -> list:
+        """Собрать пачку: всё, что уже в очереди, плюс то, что придёт за окно"""
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                job = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(job)
+            if job is _STOP:
+                break
+        return batch
+
+    def _run(self):
+        conn = connect(self.path)
+        conn.isolation_level = None
+        stop = False
+        try:
+            while not stop:
+                batch = self._collect(self._queue.get())
+                if batch[-1] is _STOP:
+                    batch.pop()
+                    stop = True
+                if batch:
+                    self._commit_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def _begin(self, conn):
+        """BEGIN IMMEDIATE с повторами, пока блокировку держит другой процесс"""
+        for attempt in range(self.lock_retries + 1):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if attempt == self.lock_retries or 'locked' not in str(e):
+                    raise
+                logger.warning("БД заблокирована другим процессом, повтор %s", attempt + 1)
+                time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
+    def _commit_batch(self, conn, batch: list):
+        results = []
+        try:
+            self._begin(conn)
+            for job in batch:
+                conn.execute("SAVEPOINT write_job")
+                _local.conn = conn
+                try:
+                    result = job.func(*job.args, **job.kwargs)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_job")
+                    results.append((job, None, e))
+                else:
+                    results.append((job, result, None))
+                finally:
+                    _local.conn = None
+                    conn.execute("RELEASE write_job")
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.exception("Ошибка группового коммита")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            results = [(job, None, e) for job in batch]
+        
+        for job, result, error in results:
+            job.loop.call_soon_threadsafe(_resolve, job.future, result, error)
+
+    def close(self):
+        """Дописать очередь и остановить поток писателя"""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+
+_writer: Optional[WriteQueue] = None
+
+
+def get_writer() -> WriteQueue:
+    """Получить (и при необходимости запустить) писателя"""
+    global _writer
+    if _writer is None:
+        _writer = WriteQueue(DATABASE_PATH, DB_WRITE_BATCH_WINDOW, DB_WRITE_BATCH_SIZE,
+                             DB_LOCK_RETRIES)
+    return _writer
+
+
+def close_writer():
+    """Остановить писателя"""
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
@@ -4,15 +4,21 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from config import ADMIN_ID
-from database.models import (
-    add_product, get_all_products, get_product, 
-    update_product, delete_product, get_all_orders, get_orders_stats
+from config import ADMIN_ID, CATALOG_PAGE_SIZE, ORDERS_PAGE_SIZE
+from database.db import (
+    add_product, get_products_page, get_product, 
+    update_product, delete_product, get_recent_orders, get_orders_stats,
+    add_stock_items, replace_stock, get_stock_count,
+    get_users_count, get_latest_broadcast, create_broadcast, finish_broadcast
 )
+from database.models import parse_stock_lines
 from keyboards.admin_kb import (
     admin_menu_kb, admin_products_kb, admin_product_actions_kb,
-    admin_confirm_delete_kb, admin_back_kb
+    admin_confirm_delete_kb, admin_back_kb, admin_orders_kb,
+    admin_broadcast_kb, admin_broadcast_confirm_kb
 )
+from services.broadcast import broadcast_report
+from services.stock_import import import_stock_document, is_importable
 
 router = Router()
 
@@ -27,6 +33,18 @@ class AdminStates(StatesGroup):
     waiting_new_price = State()
     waiting_new_description = State()
     waiting_add_stock = State()
+    
+    waiting_broadcast_message = State()
+
+# Значки статусов заказа в списке заказов
+ORDER_STATUS_EMOJI = {
+    'pending': "⏳",
+    'fulfilling': "🔄",
+    'delivered': "✅",
+    'failed': "❗",
+    'canceled': "❌",
+    'expired': "⌛",
+}
 
 def is_admin(user_id: int) -> bool:
     """Проверка на админа"""
@@ -133,7 +151,7 @@ async def admin_product_stock(message: Message, state: FSMContext):
         stock = "" if message.text and message.text.lower() == "пропустить" else message.text
     
     # Добавление товара в БД
-    product_id = add_product(
+    product_id = await add_product(
         name=data['name'],
         description=data['description'],
         price=data['price'],
@@ -141,10 +159,7 @@ async def admin_product_stock(message: Message, state: FSMContext):
         product_type=product_type
     )
     
-    if product_type == 'file':
-        stock_count = 1 if stock else 0
-    else:
-        stock_count = len(stock.split('\n')) if stock else 0
+    stock_count = await get_stock_count(product_id)
     
     type_emoji = "📎" if product_type == 'file' else "📝"
     
@@ -197,13 +212,21 @@ async def product_type_file(callback: CallbackQuery, state: FSMContext):
 # === УПРАВЛЕНИЕ ТОВАРАМИ ===
 
 @router.callback_query(F.data == "admin_products")
+@router.callback_query(F.data.startswith("admin_products_page_"))
 async def admin_products_list(callback: CallbackQuery):
-    """Список товаров"""
+    """Список товаров (постранично)"""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Доступ запрещён", show_alert=True)
         return
     
-    products = get_all_products()
+    if callback.data == "admin_products":
+        direction, cursor = 'next', 0
+    else:
+        direction, cursor = callback.data.split("_")[3:5]
+        cursor = int(cursor)
+    
+    page = await get_products_page(cursor, direction, CATALOG_PAGE_SIZE, with_stock=True)
+    products = page['products']
     
     if not products:
         await callback.message.edit_text(
@@ -213,7 +236,7 @@ async def admin_products_list(callback: CallbackQuery):
     else:
         await callback.message.edit_text(
             "📦 <b>Управление товарами</b>\n\nВыберите товар:",
-            reply_markup=admin_products_kb(products)
+            reply_markup=admin_products_kb(products, page['has_prev'], page['has_next'])
         )
     
     await callback.answer()
@@ -226,7 +249,7 @@ async def admin_product_detail(callback: CallbackQuery):
         return
     
     product_id = int(callback.data.split("_")[2])
-    product = get_product(product_id)
+    product = await get_product(product_id)
     
     if not product:
         await callback.answer("Товар не найден!", show_alert=True)
@@ -234,12 +257,8 @@ async def admin_product_detail(callback: CallbackQuery):
     
     product_type = product.get('product_type', 'text')
     
-    if product_type == 'file':
-        stock_count = 1 if product['stock'] else 0
-        type_emoji = "📎"
-    else:
-        stock_count = len(product['stock'].split('\n')) if product['stock'] else 0
-        type_emoji = "📝"
+    stock_count = product['stock_count']
+    type_emoji = "📎" if product_type == 'file' else "📝"
     
     text = f"""
 📦 <b>{product['name']}</b>
@@ -281,7 +300,7 @@ async def admin_edit_price_finish(message: Message, state: FSMContext):
         data = await state.get_data()
         product_id = data['product_id']
         
-        update_product(product_id, price=price)
+        await update_product(product_id, price=price)
         
         await message.answer(
             f"✅ Цена обновлена: {price} ₽",
@@ -314,7 +333,7 @@ async def admin_edit_desc_finish(message: Message, state: FSMContext):
     data = await state.get_data()
     product_id = data['product_id']
     
-    update_product(product_id, description=message.text)
+    await update_product(product_id, description=message.text)
     
     await message.answer(
         "✅ Описание обновлено",
@@ -333,7 +352,7 @@ async def admin_add_stock_start(callback: CallbackQuery, state: FSMContext):
         return
     
     product_id = int(callback.data.split("_")[3])
-    product = get_product(product_id)
+    product = await get_product(product_id)
     
     if not product:
         await callback.answer("Товар не найден!", show_alert=True)
@@ -350,8 +369,9 @@ async def admin_add_stock_start(callback: CallbackQuery, state: FSMContext):
         )
     else:
         await callback.message.edit_text(
-            "📦 Отправьте товары (каждый с новой строки):\n\n"
-            "Они будут добавлены к существующему стоку."
+            "📦 Отправьте товары (каждый с новой строки)\n"
+            "или файл .txt/.csv с ключами (по одному на строку, до 20 МБ):\n\n"
+            "Они будут добавлены к существующему стоку, дубликаты пропускаются."
         )
     
     await state.set_state(AdminStates.waiting_add_stock)
@@ -363,7 +383,7 @@ async def admin_add_stock_finish(message: Message, state: FSMContext):
     data = await state.get_data()
     product_id = data['product_id']
     
-    product = get_product(product_id)
+    product = await get_product(product_id)
     
     if not product:
         await message.answer("❌ Товар не найден!", reply_markup=admin_back_kb())
@@ -375,8 +395,7 @@ async def admin_add_stock_finish(message: Message, state: FSMContext):
     if product_type == 'file':
         # Обработка файла
         if message.document:
-            new_stock = message.document.file_id
-            update_product(product_id, stock=new_stock)
+            await replace_stock(product_id, message.document.file_id)
             
             await message.answer(
                 "✅ Файл обновлён!",
@@ -387,17 +406,41 @@ async def admin_add_stock_finish(message: Message, state: FSMContext):
                 "❌ Отправьте файл!",
                 reply_markup=admin_back_kb()
             )
+    elif message.document:
+        # Загрузка ключей из файла
+        if not is_importable(message.document):
+            await message.answer("❌ Поддерживаются только файлы .txt и .csv")
+            return
+        
+        progress = await message.answer("⏳ Загрузка ключей...")
+        
+        async def report(added: int, read: int):
+            await progress.edit_text(f"⏳ Загрузка ключей...\n\nПрочитано: {read}\nДобавлено: {added}")
+        
+        try:
+            added, read = await import_stock_document(message.bot, product_id, message.document, report)
+        except Exception as e:
+            await progress.edit_text(f"❌ Ошибка загрузки файла: {str(e)}", reply_markup=admin_back_kb())
+            await state.clear()
+            return
+        
+        new_count = await get_stock_count(product_id)
+        
+        await progress.edit_text(
+            f"✅ Сток обновлён!\n\n"
+            f"Прочитано ключей: {read}\n"
+            f"Добавлено: {added} (дубликатов: {read - added})\n"
+            f"Всего товаров: {new_count} шт.",
+            reply_markup=admin_back_kb()
+        )
     else:
         # Обработка текста
-        old_stock = product['stock'] if product['stock'] else ""
-        new_stock = old_stock + "\n" + message.text if old_stock else message.text
+        added = await add_stock_items(product_id, parse_stock_lines(message.text or ""))
         
-        update_product(product_id, stock=new_stock)
-        
-        new_count = len(new_stock.split('\n'))
+        new_count = await get_stock_count(product_id)
         
         await message.answer(
-            f"✅ Сток обновлён!\n\nВсего товаров: {new_count} шт.",
+            f"✅ Сток обновлён!\n\nДобавлено: {added} шт.\nВсего товаров: {new_count} шт.",
             reply_markup=admin_back_kb()
         )
     
@@ -413,7 +456,7 @@ async def admin_delete_confirm(callback: CallbackQuery):
         return
     
     product_id = int(callback.data.split("_")[2])
-    product = get_product(product_id)
+    product = await get_product(product_id)
     
     await callback.message.edit_text(
         f"⚠️ Вы уверены, что хотите удалить товар?\n\n"
@@ -431,7 +474,7 @@ async def admin_delete_finish(callback: CallbackQuery):
         return
     
     product_id = int(callback.data.split("_")[3])
-    delete_product(product_id)
+    await delete_product(product_id)
     
     await callback.message.edit_text(
         "✅ Товар удалён",
@@ -448,7 +491,7 @@ async def admin_stats(callback: CallbackQuery):
         await callback.answer("❌ Доступ запрещён", show_alert=True)
         return
     
-    stats = get_orders_stats()
+    stats = await get_orders_stats()
     
     text = f"""
 📊 <b>Статистика продаж</b>
@@ -456,6 +499,10 @@ async def admin_stats(callback: CallbackQuery):
 💰 Общая выручка: <b>{stats['total_revenue']:.2f} ₽</b>
 📦 Всего заказов: <b>{stats['total_orders']}</b>
 
+📅 Сегодня: {stats['periods']['today']['orders']} шт. ({stats['periods']['today']['revenue']:.2f} ₽)
+📅 7 дней: {stats['periods']['week']['orders']} шт. ({stats['periods']['week']['revenue']:.2f} ₽)
+📅 30 дней: {stats['periods']['month']['orders']} шт. ({stats['periods']['month']['revenue']:.2f} ₽)
+
 <b>Популярные товары:</b>
 """
     
@@ -471,27 +518,133 @@ async def admin_stats(callback: CallbackQuery):
 # === ЗАКАЗЫ ===
 
 @router.callback_query(F.data == "admin_orders")
+@router.callback_query(F.data.startswith("admin_orders_page_"))
 async def admin_orders(callback: CallbackQuery):
-    """Показать все заказы"""
+    """Показать последние заказы (постранично)"""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Доступ запрещён", show_alert=True)
         return
     
-    orders = get_all_orders()
+    if callback.data == "admin_orders":
+        status, cursor = "all", 0
+    else:
+        status, cursor = callback.data.split("_")[3:5]
+        cursor = int(cursor)
+    
+    orders = await get_recent_orders(
+        limit=ORDERS_PAGE_SIZE + 1,
+        before_cursor=cursor or None,
+        status=None if status == "all" else status
+    )
+    
+    has_more = len(orders) > ORDERS_PAGE_SIZE
+    orders = orders[:ORDERS_PAGE_SIZE]
     
     if not orders:
         await callback.message.edit_text(
             "📋 Нет заказов",
-            reply_markup=admin_back_kb()
+            reply_markup=admin_orders_kb(status)
         )
+        await callback.answer()
         return
     
     text = "📋 <b>Последние заказы</b>\n\n"
     
-    for order in orders[:10]:  # Показываем последние 10
-        status_emoji = "✅" if order['status'] == 'paid' else "⏳"
-        text += f"{status_emoji} {order['product_name']} - {order['price']} ₽\n"
+    for order in orders:
+        status_emoji = ORDER_STATUS_EMOJI.get(order['status'], "⏳")
+        quantity = f" × {order['quantity']}" if order['quantity'] > 1 else ""
+        text += f"{status_emoji} {order['product_name']}{quantity} - {order['price']} ₽\n"
         text += f"   @{order['username']} | {order['created_at'][:16]}\n\n"
     
-    await callback.message.edit_text(text, reply_markup=admin_back_kb())
-    await callback.answer()
\ No newline at end of file
+    next_cursor = orders[-1]['id'] if has_more else None
+    await callback.message.edit_text(text, reply_markup=admin_orders_kb(status, next_cursor))
+    await callback.answer()
+
+# === РАССЫЛКА ===
+
+@router.callback_query(F.data == "admin_broadcast")
+async def admin_broadcast(callback: CallbackQuery, state: FSMContext):
+    """Состояние рассылки"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Доступ запрещён", show_alert=True)
+        return
+    
+    await state.clear()
+    broadcast = await get_latest_broadcast()
+    users_count = await get_users_count()
+    
+    text = f"👥 Активных пользователей: <b>{users_count}</b>\n\n"
+    if broadcast:
+        text += broadcast_report(broadcast)
+    else:
+        text += "Рассылок ещё не было"
+    
+    running = broadcast is not None and broadcast['status'] == 'running'
+    await callback.message.edit_text(text, reply_markup=admin_broadcast_kb(running))
+    await callback.answer()
+
+@router.callback_query(F.data == "admin_broadcast_new")
+async def admin_broadcast_new(callback: CallbackQuery, state: FSMContext):
+    """Начать подготовку рассылки"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Доступ запрещён", show_alert=True)
+        return
+    
+    await callback.message.edit_text(
+        "📢 Отправьте сообщение для рассылки (текст, фото, файл).\n"
+        "Пользователи получат его копию."
+    )
+    await state.set_state(AdminStates.waiting_broadcast_message)
+    await callback.answer()
+
+@router.message(AdminStates.waiting_broadcast_message)
+async def admin_broadcast_message(message: Message, state: FSMContext):
+    """Получить сообщение для рассылки и запросить подтверждение"""
+    await state.update_data(from_chat_id=message.chat.id, message_id=message.message_id)
+    users_count = await get_users_count()
+    await message.answer(
+        f"Разослать это сообщение <b>{users_count}</b> пользователям?",
+        reply_markup=admin_broadcast_confirm_kb()
+    )
+
+@router.callback_query(F.data == "admin_broadcast_confirm")
+async def admin_broadcast_confirm(callback: CallbackQuery, state: FSMContext):
+    """Запустить рассылку"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Доступ запрещён", show_alert=True)
+        return
+    
+    data = await state.get_data()
+    await state.clear()
+    if 'message_id' not in data:
+        await callback.answer("Сообщение для рассылки не найдено", show_alert=True)
+        return
+    
+    latest = await get_latest_broadcast()
+    if latest and latest['status'] == 'running':
+        await callback.answer("⏳ Предыдущая рассылка ещё идёт", show_alert=True)
+        return
+    
+    broadcast_id = await create_broadcast(data['from_chat_id'], data['message_id'])
+    await callback.message.edit_text(
+        f"✅ Рассылка #{broadcast_id} запущена. Итоги придут сообщением.",
+        reply_markup=admin_broadcast_kb(True)
+    )
+    await callback.answer()
+
+@router.callback_query(F.data == "admin_broadcast_stop")
+async def admin_broadcast_stop(callback: CallbackQuery):
+    """Остановить текущую рассылку"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Доступ запрещён", show_alert=True)
+        return
+    
+    broadcast = await get_latest_broadcast()
+    if broadcast and await finish_broadcast(broadcast['id'], 'canceled'):
+        await callback.answer("⛔ Рассылка остановлена", show_alert=True)
+    else:
+        await callback.answer("Нет активной рассылки", show_alert=True)
+    
+    broadcast = await get_latest_broadcast()
+    if broadcast:
+        await callback.message.edit_text(broadcast_report(broadcast), reply_markup=admin_broadcast_kb(False))
@@ -1,17 +1,32 @@
+from html import escape
+
 from aiogram import Router, F
-from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery
+from aiogram.filters import Command, CommandObject
+from aiogram.types import (
+    Message, CallbackQuery, InlineQuery, InlineQueryResultArticle, InlineQueryResultsButton,
+    InputTextMessageContent
+)
 from aiogram.fsm.context import FSMContext
 
+from config import (
+    CATALOG_PAGE_SIZE, STOCK_RESERVATION_TTL, ORDER_QUANTITY_OPTIONS, MAX_ORDER_QUANTITY,
+    SEARCH_PAGE_SIZE, SEARCH_CACHE_TIME
+)
+from database.cache import products_cache
+from database.db import (
+    get_products_page, get_product, reserve_order, attach_payment, cancel_order,
+    get_active_order, search_products, complete_fulfillment
+)
 from database.models import (
-    get_all_products, get_product, create_order, 
-    get_order_by_payment, update_order_status, get_stock_item, add_user
+    ALREADY_DELIVERED, IN_PROGRESS, ORDER_NOT_FOUND, PRODUCT_NOT_FOUND, OUT_OF_STOCK
 )
 from keyboards.user_kb import (
     main_menu_kb, catalog_kb, product_kb, 
-    payment_kb, back_to_main_kb
+    payment_kb, back_to_main_kb, open_product_kb
 )
 from services.payment import create_payment, check_payment
+from services.registration import get_registry
+from services.fulfillment import fulfill_payment, send_items
 
 router = Router()
 
@@ -51,19 +66,98 @@ Email: support@example.com
 Время ответа: обычно в течение 1 часа
 """
 
-@router.message(Command("start"))
-async def cmd_start(message: Message):
-    """Команда /start"""
-    # Сохраняем пользователя в БД
-    add_user(
-        user_id=message.from_user.id,
-        username=message.from_user.username,
-        first_name=message.from_user.first_name,
-        last_name=message.from_user.last_name
+def product_card_text(product: dict) -> str:
+    """Текст карточки товара"""
+    product_type = product.get('product_type', 'text')
+    
+    if product_type == 'file':
+        type_text = "📎 Тип: Файл"
+    else:
+        type_text = "📝 Тип: Текст/Ключ"
+    
+    return f"""
+📦 <b>{product['name']}</b>
+
+{product['description']}
+
+{type_text}
+💰 Цена: <b>{product['price']} ₽</b>
+📊 В наличии: {product['stock_count']} шт.
+"""
+
+def quantity_options(product: dict) -> tuple:
+    """Варианты оптовой покупки, которые позволяет сток (файлы - только поштучно)"""
+    if product.get('product_type') == 'file':
+        return ()
+    limit = min(product['stock_count'], MAX_ORDER_QUANTITY)
+    return tuple(quantity for quantity in ORDER_QUANTITY_OPTIONS if 1 < quantity <= limit)
+
+def cached_card_text(product: dict) -> str:
+    """Текст карточки товара из кэша"""
+    return products_cache.get_or_build(
+        ('product_card', product['id']), lambda: product_card_text(product)
     )
+
+@router.message(Command("start"))
+async def cmd_start(message: Message, command: CommandObject):
+    """Команда /start (в т.ч. по ссылке на товар из inline-поиска)"""
+    # Сохраняем пользователя (пачкой, повторные визиты не пишут в БД)
+    get_registry().touch(message.from_user)
+    
+    # Параметр ссылки присылает клиент: неверный - просто приветствие
+    product_id = (command.args or "").removeprefix("product_")
+    if command.args and command.args.startswith("product_") and product_id.isdecimal():
+        product = await get_product(int(product_id))
+        if product:
+            await message.answer(
+                cached_card_text(product),
+                reply_markup=product_kb(product['id'], product['price'], quantity_options(product))
+            )
+            return
     
     await message.answer(START_TEXT, reply_markup=main_menu_kb())
 
+@router.message(Command("search"))
+async def cmd_search(message: Message, command: CommandObject):
+    """Поиск товаров: /search запрос"""
+    if not command.args:
+        await message.answer("🔎 Использование: <code>/search название товара</code>")
+        return
+    
+    products = await search_products(command.args, SEARCH_PAGE_SIZE)
+    if not products:
+        await message.answer("🔎 Ничего не найдено", reply_markup=back_to_main_kb())
+        return
+    
+    await message.answer(
+        f"🔎 Найдено по запросу «{escape(command.args)}»:",
+        reply_markup=catalog_kb(products)
+    )
+
+@router.inline_query()
+async def inline_search(inline_query: InlineQuery):
+    """Поиск товаров в inline-режиме (@бот запрос)"""
+    offset = int(inline_query.offset or 0)
+    products = await search_products(inline_query.query, SEARCH_PAGE_SIZE, offset)
+    
+    username = (await inline_query.bot.me()).username
+    results = [
+        InlineQueryResultArticle(
+            id=str(product['id']),
+            title=product['name'],
+            description=f"{product['price']} ₽ · в наличии {product['stock_count']} шт.",
+            input_message_content=InputTextMessageContent(message_text=cached_card_text(product)),
+            reply_markup=open_product_kb(username, product['id'])
+        )
+        for product in products
+    ]
+    
+    next_offset = str(offset + len(products)) if len(products) == SEARCH_PAGE_SIZE else ""
+    await inline_query.answer(
+        results, cache_time=SEARCH_CACHE_TIME, is_personal=False, next_offset=next_offset,
+        button=InlineQueryResultsButton(text="🛒 Открыть каталог в боте", start_parameter="catalog")
+    )
+
 @router.callback_query(F.data == "back_to_main")
 async def back_to_main(callback: CallbackQuery):
     """Возврат в главное меню"""
@@ -71,9 +165,17 @@ async def back_to_main(callback: CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "catalog")
+@router.callback_query(F.data.startswith("catalog_page_"))
 async def show_catalog(callback: CallbackQuery):
-    """Показать каталог"""
-    products = get_all_products()
+    """Показать страницу каталога"""
+    if callback.data == "catalog":
+        direction, cursor = 'next', 0
+    else:
+        _, _, direction, cursor = callback.data.split("_")
+        cursor = int(cursor)
+    
+    page = await get_products_page(cursor, direction, CATALOG_PAGE_SIZE)
+    products = page['products']
     
     if not products:
         await callback.message.edit_text(
@@ -83,7 +185,10 @@ async def show_catalog(callback: CallbackQuery):
     else:
         await callback.message.edit_text(
             "🛒 <b>Каталог товаров</b>\n\nВыберите товар:",
-            reply_markup=catalog_kb(products)
+            reply_markup=products_cache.get_or_build(
+                ('catalog_kb', direction, cursor),
+                lambda: catalog_kb(products, page['has_prev'], page['has_next'])
+            )
         )
     
     await callback.answer()
@@ -92,94 +197,107 @@ async def show_catalog(callback: CallbackQuery):
 async def show_product(callback: CallbackQuery):
     """Показать товар"""
     product_id = int(callback.data.split("_")[1])
-    product = get_product(product_id)
+    product = await get_product(product_id)
     
     if not product:
         await callback.answer("Товар не найден!", show_alert=True)
         return
     
-    product_type = product.get('product_type', 'text')
-    
-    if product_type == 'file':
-        stock_count = 1 if product['stock'] else 0
-        type_text = "📎 Тип: Файл"
-    else:
-        stock_count = len(product['stock'].split('\n')) if product['stock'] else 0
-        type_text = "📝 Тип: Текст/Ключ"
-    
-    text = f"""
-📦 <b>{product['name']}</b>
+    await callback.message.edit_text(
+        cached_card_text(product),
+        reply_markup=product_kb(product_id, product['price'], quantity_options(product))
+    )
+    await callback.answer()
 
-{product['description']}
+def payment_text(name: str, amount: float) -> str:
+    """Текст сообщения с оплатой заказа"""
+    return f"""
+💳 <b>Оплата заказа</b>
 
-{type_text}
-💰 Цена: <b>{product['price']} ₽</b>
-📊 В наличии: {stock_count} шт.
+Товар: {name}
+Сумма: {amount} ₽
+
+Нажмите кнопку ниже для оплаты.
+После оплаты нажмите "Проверить оплату" для получения товара.
 """
-    
-    await callback.message.edit_text(text, reply_markup=product_kb(product_id))
-    await callback.answer()
 
 @router.callback_query(F.data.startswith("buy_"))
 async def buy_product(callback: CallbackQuery):
     """Начать покупку"""
-    product_id = int(callback.data.split("_")[1])
-    product = get_product(product_id)
+    parts = callback.data.split("_")
+    product_id = int(parts[1])
+    quantity = int(parts[2]) if len(parts) > 2 else 1
+    product = await get_product(product_id)
     
     if not product:
         await callback.answer("Товар не найден!", show_alert=True)
         return
     
-    # Проверка наличия
-    product_type = product.get('product_type', 'text')
+    if not 1 <= quantity <= MAX_ORDER_QUANTITY or (quantity > 1 and product['product_type'] == 'file'):
+        await callback.answer("❌ Недопустимое количество", show_alert=True)
+        return
     
-    if product_type == 'file':
-        stock_count = 1 if product['stock'] else 0
-    else:
-        stock_count = len(product['stock'].split('\n')) if product['stock'] else 0
+    name = product['name'] if quantity == 1 else f"{product['name']} × {quantity}"
+    
+    # Повторное нажатие: тот же заказ и платёж, пока держится резерв
+    order = await get_active_order(callback.from_user.id, product_id)
+    if order and order['quantity'] == quantity and order['payment_url']:
+        await callback.message.edit_text(
+            payment_text(name, order['price']),
+            reply_markup=payment_kb(order['payment_url'], order['payment_id'], order['id'])
+        )
+        await callback.answer()
+        return
+    
+    # Проверка наличия (резерв прошлого заказа пользователя будет снят)
+    available = product['stock_count'] + (order['quantity'] if order else 0)
+    if available == 0:
+        await callback.answer("❌ Товар закончился!", show_alert=True)
+        return
+    
+    if available < quantity:
+        await callback.answer(f"❌ В наличии только {available} шт.", show_alert=True)
+        return
+    
+    amount = round(product['price'] * quantity, 2)
     
-    if stock_count == 0:
+    # Заказ с резервом нужного количества единиц на время оплаты
+    order_id = await reserve_order(
+        user_id=callback.from_user.id,
+        username=callback.from_user.username or "Unknown",
+        product_id=product_id,
+        product_name=product['name'],
+        price=amount,
+        ttl_seconds=STOCK_RESERVATION_TTL,
+        quantity=quantity
+    )
+    
+    if order_id is None:
         await callback.answer("❌ Товар закончился!", show_alert=True)
         return
     
     try:
         # Создание платежа
-        payment_data = create_payment(
-            amount=product['price'],
-            description=f"Покупка: {product['name']}"
-        )
-        
-        # Сохранение заказа
-        create_order(
-            user_id=callback.from_user.id,
-            username=callback.from_user.username or "Unknown",
-            product_id=product_id,
-            product_name=product['name'],
-            price=product['price'],
-            payment_id=payment_data['payment_id']
-        )
-        
-        text = f"""
-💳 <b>Оплата заказа</b>
-
-Товар: {product['name']}
-Сумма: {product['price']} ₽
-
-Нажмите кнопку ниже для оплаты.
-После оплаты нажмите "Проверить оплату" для получения товара.
-"""
-        
-        await callback.message.edit_text(
-            text,
-            reply_markup=payment_kb(
-                payment_data['confirmation_url'],
-                payment_data['payment_id']
-            )
+        payment_data = await create_payment(
+            amount=amount,
+            description=f"Покупка: {name}"
         )
         
+        await attach_payment(order_id, payment_data['payment_id'], payment_data['confirmation_url'])
     except Exception as e:
+        await cancel_order(order_id)
         await callback.answer(f"Ошибка создания платежа: {str(e)}", show_alert=True)
+        return
     
+    # Платёж уже привязан к заказу: ошибка показа не должна отменять заказ
+    await callback.message.edit_text(
+        payment_text(name, amount),
+        reply_markup=payment_kb(
+            payment_data['confirmation_url'],
+            payment_data['payment_id'],
+            order_id
+        )
+    )
     await callback.answer()
 
 @router.callback_query(F.data.startswith("check_payment_"))
@@ -189,76 +307,45 @@ async def check_payment_status(callback: CallbackQuery):
     
     try:
         # Проверка статуса платежа
-        payment_info = check_payment(payment_id)
+        payment_info = await check_payment(payment_id)
         
         if payment_info['status'] == 'succeeded' and payment_info['paid']:
-            # Получение заказа
-            order = get_order_by_payment(payment_id)
+            result = await fulfill_payment(payment_id)
+            status = result['status']
             
-            if not order:
+            if status == ORDER_NOT_FOUND:
                 await callback.answer("Заказ не найден!", show_alert=True)
                 return
             
-            if order['status'] == 'paid':
+            if status == ALREADY_DELIVERED:
                 await callback.answer("✅ Товар уже был выдан!", show_alert=True)
                 return
             
-            # Получение товара
-            product = get_product(order['product_id'])
+            if status == IN_PROGRESS:
+                await callback.answer("⏳ Товар уже выдаётся, подождите немного.", show_alert=True)
+                return
             
-            if not product:
+            if status == PRODUCT_NOT_FOUND:
                 await callback.answer("❌ Товар не найден!", show_alert=True)
                 return
             
-            # Проверка типа товара
-            if product['product_type'] == 'file':
-                # Товар - файл
-                item = get_stock_item(order['product_id'])
-                
-                if not item:
-                    await callback.answer("❌ Файлы закончились! Свяжитесь с поддержкой.", show_alert=True)
-                    return
-                
-                # Обновление статуса заказа
-                update_order_status(payment_id, 'paid')
-                
-                # Отправка файла
-                try:
-                    await callback.message.answer_document(
-                        document=item,
-                        caption=f"✅ <b>Оплата прошла успешно!</b>\n\nВаш файл: {product['name']}\n\nСпасибо за покупку! 🎉"
-                    )
-                    await callback.message.edit_text(
-                        "✅ Файл отправлен! Проверьте сообщения выше.",
-                        reply_markup=back_to_main_kb()
-                    )
-                except Exception as e:
-                    await callback.answer(f"Ошибка отправки файла: {str(e)}", show_alert=True)
-                    return
-                
-            else:
-                # Товар - текст/ключ
-                item = get_stock_item(order['product_id'])
-                
-                if not item:
-                    await callback.answer("❌ Товар закончился! Свяжитесь с поддержкой.", show_alert=True)
-                    return
-                
-                # Обновление статуса заказа
-                update_order_status(payment_id, 'paid')
-                
-                # Отправка товара
-                success_text = f"""
-✅ <b>Оплата прошла успешно!</b>
-
-Ваш товар:
-<code>{item}</code>
-
-Спасибо за покупку! 🎉
-"""
-                
-                await callback.message.edit_text(success_text, reply_markup=back_to_main_kb())
+            if status == OUT_OF_STOCK:
+                await callback.answer("❌ Товар закончился! Свяжитесь с поддержкой.", show_alert=True)
+                return
             
+            # Отправка тем же путём, что и по уведомлению ЮKassa
+            order = result['order']
+            try:
+                await send_items(callback.bot, order['user_id'], result['product'], result['items'])
+            except Exception as e:
+                await callback.answer(f"Ошибка отправки товара: {str(e)}", show_alert=True)
+                return
+            
+            await complete_fulfillment(order['id'])
+            await callback.message.edit_text(
+                "✅ Товар отправлен! Проверьте сообщения ниже.",
+                reply_markup=back_to_main_kb()
+            )
             await callback.answer("✅ Товар получен!", show_alert=True)
             
         elif payment_info['status'] == 'pending':
@@ -269,9 +356,12 @@ async def check_payment_status(callback: CallbackQuery):
     except Exception as e:
         await callback.answer(f"Ошибка проверки: {str(e)}", show_alert=True)
 
-@router.callback_query(F.data == "cancel_payment")
+@router.callback_query(F.data.startswith("cancel_payment"))
 async def cancel_payment(callback: CallbackQuery):
-    """Отмена платежа"""
+    """Отмена платежа: заказ отменяется, резерв возвращается в сток"""
+    order_id = callback.data.removeprefix("cancel_payment").lstrip("_")
+    if order_id.isdigit():
+        await cancel_order(int(order_id), user_id=callback.from_user.id)
     await callback.message.edit_text(
         "❌ Платёж отменён.",
         reply_markup=back_to_main_kb()
@@ -1,6 +1,10 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from typing import List, Dict
 
+from keyboards.render import static_markup, memoized_markup
+from keyboards.user_kb import page_nav_row
+
+@static_markup
 def admin_menu_kb() -> InlineKeyboardMarkup:
     """Админ меню"""
     keyboard = [
@@ -8,23 +12,20 @@ def admin_menu_kb() -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text="📦 Управление товарами", callback_data="admin_products")],
         [InlineKeyboardButton(text="📊 Статистика", callback_data="admin_stats")],
         [InlineKeyboardButton(text="📋 Все заказы", callback_data="admin_orders")],
+        [InlineKeyboardButton(text="📢 Рассылка", callback_data="admin_broadcast")],
         [InlineKeyboardButton(text="❌ Закрыть", callback_data="admin_close")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-def admin_products_kb(products: List[Dict]) -> InlineKeyboardMarkup:
-    """Список товаров для управления"""
+def admin_products_kb(products: List[Dict], has_prev: bool = False,
+                      has_next: bool = False) -> InlineKeyboardMarkup:
+    """Список товаров для управления (одна страница)"""
     keyboard = []
     
     for product in products:
         product_type = product.get('product_type', 'text')
-        
-        if product_type == 'file':
-            stock_count = 1 if product['stock'] else 0
-            type_emoji = "📎"
-        else:
-            stock_count = len(product['stock'].split('\n')) if product['stock'] else 0
-            type_emoji = "📝"
+        stock_count = product['stock_count']
+        type_emoji = "📎" if product_type == 'file' else "📝"
         
         keyboard.append([
             InlineKeyboardButton(
@@ -33,10 +34,15 @@ def admin_products_kb(products: List[Dict]) -> InlineKeyboardMarkup:
             )
         ])
     
+    nav_row = page_nav_row("admin_products_page", products, has_prev, has_next)
+    if nav_row:
+        keyboard.append(nav_row)
+    
     keyboard.append([InlineKeyboardButton(text="◀️ Назад", callback_data="admin_menu")])
     
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+@memoized_markup
 def admin_product_actions_kb(product_id: int) -> InlineKeyboardMarkup:
     """Действия с товаром"""
     keyboard = [
@@ -48,6 +54,7 @@ def admin_product_actions_kb(product_id: int) -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+@memoized_markup
 def admin_confirm_delete_kb(product_id: int) -> InlineKeyboardMarkup:
     """Подтверждение удаления"""
     keyboard = [
@@ -56,9 +63,52 @@ def admin_confirm_delete_kb(product_id: int) -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+def admin_orders_kb(status: str = "all", next_cursor: int = None) -> InlineKeyboardMarkup:
+    """Фильтры и листание списка заказов"""
+    filters = [("Все", "all"), ("✅ Выданные", "delivered"), ("⏳ Ожидающие", "pending")]
+    keyboard = [[
+        InlineKeyboardButton(
+            text=f"• {text}" if value == status else text,
+            callback_data=f"admin_orders_page_{value}_0"
+        )
+        for text, value in filters
+    ]]
+    
+    if next_cursor is not None:
+        keyboard.append([
+            InlineKeyboardButton(text="⏮ В начало", callback_data=f"admin_orders_page_{status}_0"),
+            InlineKeyboardButton(text="Старше ➡️", callback_data=f"admin_orders_page_{status}_{next_cursor}")
+        ])
+    
+    keyboard.append([InlineKeyboardButton(text="◀️ Админ меню", callback_data="admin_menu")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+@static_markup
 def admin_back_kb() -> InlineKeyboardMarkup:
     """Кнопка назад в админ меню"""
     keyboard = [
         [InlineKeyboardButton(text="◀️ Админ меню", callback_data="admin_menu")]
     ]
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
\ No newline at end of file
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+@memoized_markup
+def admin_broadcast_kb(running: bool) -> InlineKeyboardMarkup:
+    """Экран рассылки: обновить/остановить текущую или начать новую"""
+    if running:
+        keyboard = [[
+            InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_broadcast"),
+            InlineKeyboardButton(text="⛔ Остановить", callback_data="admin_broadcast_stop")
+        ]]
+    else:
+        keyboard = [[InlineKeyboardButton(text="✉️ Новая рассылка", callback_data="admin_broadcast_new")]]
+    keyboard.append([InlineKeyboardButton(text="◀️ Админ меню", callback_data="admin_menu")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+@static_markup
+def admin_broadcast_confirm_kb() -> InlineKeyboardMarkup:
+    """Подтверждение запуска рассылки"""
+    keyboard = [
+        [InlineKeyboardButton(text="✅ Разослать", callback_data="admin_broadcast_confirm")],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data="admin_broadcast")]
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -0,0 +1,30 @@
+"""Слой рендеринга клавиатур.
+
+Построение InlineKeyboardMarkup - это создание и валидация pydantic-моделей,
+заметная доля времени обработки каждого callback. Статичные клавиатуры
+строятся один раз при импорте, параметризованные запоминаются по аргументам
+в ограниченном LRU. Готовые разметки общие для всех вызовов - их нельзя
+изменять после получения.
+"""
+from functools import lru_cache, wraps
+from typing import Callable
+
+from aiogram.types import InlineKeyboardMarkup
+
+from config import KEYBOARD_CACHE_SIZE
+
+
+def static_markup(builder: Callable[[], InlineKeyboardMarkup]) -> Callable[[], InlineKeyboardMarkup]:
+    """Построить клавиатуру без параметров один раз при импорте"""
+    markup = builder()
+
+    @wraps(builder)
+    def get_markup() -> InlineKeyboardMarkup:
+        return markup
+
+    return get_markup
+
+
+def memoized_markup(builder: Callable[..., InlineKeyboardMarkup]) -> Callable[..., InlineKeyboardMarkup]:
+    """Запоминать клавиатуры по аргументам (не более KEYBOARD_CACHE_SIZE штук)"""
+    return lru_cache(maxsize=KEYBOARD_CACHE_SIZE)(builder)
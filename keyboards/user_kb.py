@@ -1,6 +1,9 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 from typing import List, Dict
 
+from keyboards.render import static_markup, memoized_markup
+
+@static_markup
 def main_menu_kb() -> InlineKeyboardMarkup:
     """Главное меню"""
     keyboard = [
@@ -10,8 +13,18 @@ def main_menu_kb() -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-def catalog_kb(products: List[Dict]) -> InlineKeyboardMarkup:
-    """Каталог товаров"""
+def page_nav_row(prefix: str, products: List[Dict], has_prev: bool,
+                 has_next: bool) -> List[InlineKeyboardButton]:
+    """Кнопки листания страниц (курсор - id крайнего товара страницы)"""
+    row = []
+    if has_prev:
+        row.append(InlineKeyboardButton(text="⬅️", callback_data=f"{prefix}_prev_{products[0]['id']}"))
+    if has_next:
+        row.append(InlineKeyboardButton(text="➡️", callback_data=f"{prefix}_next_{products[-1]['id']}"))
+    return row
+
+def catalog_kb(products: List[Dict], has_prev: bool = False, has_next: bool = False) -> InlineKeyboardMarkup:
+    """Каталог товаров (одна страница)"""
     keyboard = []
     
     for product in products:
@@ -22,27 +35,53 @@ def catalog_kb(products: List[Dict]) -> InlineKeyboardMarkup:
             )
         ])
     
+    nav_row = page_nav_row("catalog_page", products, has_prev, has_next)
+    if nav_row:
+        keyboard.append(nav_row)
+    
     keyboard.append([InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main")])
     
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-def product_kb(product_id: int) -> InlineKeyboardMarkup:
-    """Кнопки для конкретного товара"""
+@memoized_markup
+def product_kb(product_id: int, price: float = 0, quantities: tuple = ()) -> InlineKeyboardMarkup:
+    """Кнопки для конкретного товара (quantities - варианты оптовой покупки)"""
+    keyboard = [
+        [InlineKeyboardButton(text="💳 Купить", callback_data=f"buy_{product_id}")]
+    ]
+    
+    # По два варианта количества в ряд: "×10 - 1000 ₽"
+    buttons = [
+        InlineKeyboardButton(
+            text=f"×{quantity} - {round(price * quantity, 2)} ₽",
+            callback_data=f"buy_{product_id}_{quantity}"
+        )
+        for quantity in quantities
+    ]
+    for i in range(0, len(buttons), 2):
+        keyboard.append(buttons[i:i + 2])
+    
+    keyboard.append([InlineKeyboardButton(text="◀️ К каталогу", callback_data="catalog")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+@memoized_markup
+def open_product_kb(bot_username: str, product_id: int) -> InlineKeyboardMarkup:
+    """Кнопка под товаром из inline-поиска: открыть карточку в боте"""
     keyboard = [
-        [InlineKeyboardButton(text="💳 Купить", callback_data=f"buy_{product_id}")],
-        [InlineKeyboardButton(text="◀️ К каталогу", callback_data="catalog")]
+        [InlineKeyboardButton(text="🛒 Открыть в боте", url=f"https://t.me/{bot_username}?start=product_{product_id}")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-def payment_kb(payment_url: str, payment_id: str) -> InlineKeyboardMarkup:
+def payment_kb(payment_url: str, payment_id: str, order_id: int) -> InlineKeyboardMarkup:
     """Кнопки для оплаты"""
     keyboard = [
         [InlineKeyboardButton(text="💳 Оплатить", url=payment_url)],
         [InlineKeyboardButton(text="✅ Проверить оплату", callback_data=f"check_payment_{payment_id}")],
-        [InlineKeyboardButton(text="❌ Отменить", callback_data="cancel_payment")]
+        [InlineKeyboardButton(text="❌ Отменить", callback_data=f"cancel_payment_{order_id}")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+@static_markup
 def back_to_main_kb() -> InlineKeyboardMarkup:
     """Кнопка назад в главное меню"""
     keyboard = [
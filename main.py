@@ -1,13 +1,39 @@
 import asyncio
 import logging
+import multiprocessing
+import signal
+import time
+from contextlib import closing
 
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN, RUN_MODE, THROTTLE_RULES, THROTTLE_IDLE_TTL,
+    UPDATE_CONCURRENCY, SHUTDOWN_DRAIN_TIMEOUT,
+    FSM_FLUSH_INTERVAL, FSM_CACHE_TTL, FSM_STATE_TTL, FSM_CACHE_SIZE,
+    DATABASE_PATH, WEBHOOK_WORKERS, CACHE_SYNC_INTERVAL, METRICS_HOST, METRICS_PORT
+)
+from database.cache import products_cache
+from database.fsm_storage import SQLiteStorage
+from database.migrations import apply_migrations
 from database.models import init_db
+from database.pool import close_pool, connect
+from database.writer import close_writer
+from services import fulfillment
+from services.broadcast import Broadcaster
+from services.cache_sync import run_cache_sync
+from services.metrics import start_metrics_server
+from services.payment import close_client
+from services.reconciler import Reconciler
+from services.registration import get_registry
+from services.reservations import run_reservation_sweeper
+from services.webhook import run_webhook
 from handlers import user, admin
+from middlewares.concurrency import ConcurrencyMiddleware
+from middlewares.metrics import MetricsMiddleware
+from middlewares.throttling import ThrottlingMiddleware
 
 # -------------------- ЛОГИРОВАНИЕ --------------------
 logging.basicConfig(
@@ -17,9 +43,27 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+async def drain(tasks, timeout: float):
+    """Дождаться незавершённых апдейтов и выдач, но не дольше timeout"""
+    if not tasks:
+        return
+    logger.info("Ожидание незавершённых задач: %s", len(tasks))
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    if pending:
+        logger.warning("Не дождались завершения задач: %s", len(pending))
+
+
 # -------------------- MAIN --------------------
-async def main():
-    """Главная функция запуска бота"""
+async def main(worker: int = 0, workers: int = 1):
+    """
+    Главная функция запуска бота
+
+    Args:
+        worker: номер воркера; фоновые задачи с ЮKassa и стоком
+            выполняет только нулевой
+        workers: сколько воркеров делят БД и порт вебхука
+    """
+    primary = worker == 0
 
     # Инициализация бота (aiogram 3.7+)
     bot = Bot(
@@ -27,29 +71,166 @@ async def main():
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
 
-    # Диспетчер
-    dp = Dispatcher()
+    # Диспетчер (состояния FSM переживают перезапуск; у нескольких
+    # воркеров - без кэша, каждое изменение сразу в БД)
+    storage = SQLiteStorage(FSM_FLUSH_INTERVAL, FSM_CACHE_TTL, FSM_STATE_TTL, FSM_CACHE_SIZE,
+                            write_through=workers > 1)
+    dp = Dispatcher(storage=storage)
 
     # Инициализация базы данных
     init_db()
     logger.info("База данных инициализирована")
 
+    # Параллельная обработка апдейтов, по очереди для каждого пользователя
+    concurrency = ConcurrencyMiddleware(UPDATE_CONCURRENCY)
+    dp.update.outer_middleware(concurrency)
+
+    # Время хендлеров и ошибки (первым, чтобы учитывать и отброшенные throttling-ом)
+    metrics = MetricsMiddleware()
+    for router in (user.router, admin.router):
+        router.message.middleware(metrics)
+        router.callback_query.middleware(metrics)
+        router.inline_query.middleware(metrics)
+
+    # Ограничение частоты callback-ов (общие корзины для обоих роутеров)
+    throttling = ThrottlingMiddleware(THROTTLE_RULES, THROTTLE_IDLE_TTL)
+    user.router.callback_query.middleware(throttling)
+    admin.router.callback_query.middleware(throttling)
+
     # Подключение роутеров
     dp.include_router(user.router)
     dp.include_router(admin.router)
 
-    logger.info("Бот запущен")
+    background = []
+    if primary:
+        # Фоновая сверка неоплаченных заказов
+        background.append(asyncio.create_task(Reconciler(bot).run()))
 
-    # Запуск polling
-    await dp.start_polling(
-        bot,
-        allowed_updates=dp.resolve_used_update_types()
-    )
+        # Снятие просроченных резервов стока
+        background.append(asyncio.create_task(run_reservation_sweeper()))
 
+        # Рассылки (незавершённая продолжается после перезапуска)
+        background.append(asyncio.create_task(Broadcaster(bot).run()))
 
-# -------------------- ENTRY POINT --------------------
-if __name__ == "__main__":
+    # Пакетная запись новых пользователей
+    registry = get_registry()
+    background.append(asyncio.create_task(registry.run()))
+
+    # Отложенная запись состояний FSM
+    background.append(asyncio.create_task(storage.run()))
+
+    # Согласование кэшей каталога и известных пользователей с другими воркерами
+    if workers > 1:
+        background.append(asyncio.create_task(
+            run_cache_sync(products_cache, 'products', CACHE_SYNC_INTERVAL)
+        ))
+        background.append(asyncio.create_task(
+            run_cache_sync(registry, 'users', CACHE_SYNC_INTERVAL)
+        ))
+
+    # Метрики Prometheus на локальном порту (у каждого воркера свой)
+    metrics_runner = None
+    if METRICS_PORT:
+        try:
+            metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT + worker)
+            logger.info("Метрики: http://%s:%s/metrics", METRICS_HOST, METRICS_PORT + worker)
+        except OSError as e:
+            logger.error("Не удалось запустить сервер метрик на %s:%s: %s",
+                         METRICS_HOST, METRICS_PORT + worker, e)
+
+    logger.info("Бот запущен (воркер %s из %s)", worker + 1, workers)
+
+    try:
+        if RUN_MODE == "webhook":
+            # Запуск вебхука (Telegram + уведомления ЮKassa)
+            await run_webhook(bot, dp, set_webhook=primary, reuse_port=workers > 1)
+        else:
+            # Запуск polling (сессию закрываем сами, после drain)
+            await dp.start_polling(
+                bot,
+                handle_as_tasks=True,
+                close_bot_session=False,
+                allowed_updates=dp.resolve_used_update_types()
+            )
+    finally:
+        for task in background:
+            task.cancel()
+        await drain(concurrency.in_flight | fulfillment.in_flight(), SHUTDOWN_DRAIN_TIMEOUT)
+        await registry.flush()
+        await storage.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await bot.session.close()
+        await close_client()
+        close_writer()
+        close_pool()
+
+
+# -------------------- ВОРКЕРЫ --------------------
+def run_worker(worker: int, workers: int):
+    """Точка входа процесса-воркера"""
     try:
-        asyncio.run(main())
+        asyncio.run(main(worker, workers))
     except KeyboardInterrupt:
-        logger.info("Бот остановлен")
+        pass
+
+
+def supervise(workers: int):
+    """
+    Запустить workers процессов вебхука на общем порту и следить за ними
+
+    Миграции применяются один раз до запуска воркеров. Упавший воркер
+    перезапускается; SIGTERM/SIGINT пересылаются воркерам, и супервизор
+    ждёт их штатного завершения. Порядок апдейтов одного пользователя
+    (ConcurrencyMiddleware) соблюдается только внутри воркера.
+    """
+    with closing(connect(DATABASE_PATH)) as conn:
+        apply_migrations(conn)
+
+    # spawn: воркер не наследует потоки и соединения родителя
+    ctx = multiprocessing.get_context("spawn")
+    processes = {}
+    stopping = False
+
+    def start(worker: int):
+        process = ctx.Process(target=run_worker, args=(worker, workers), name=f"bot-worker-{worker}")
+        process.start()
+        processes[worker] = process
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for worker in range(workers):
+        start(worker)
+    logger.info("Запущено воркеров: %s", workers)
+
+    while processes:
+        for worker, process in list(processes.items()):
+            process.join(timeout=1)
+            if process.is_alive():
+                continue
+            del processes[worker]
+            if not stopping:
+                logger.warning("Воркер %s завершился с кодом %s, перезапуск", worker, process.exitcode)
+                time.sleep(1)
+                start(worker)
+
+    logger.info("Бот остановлен")
+
+
+# -------------------- ENTRY POINT --------------------
+if __name__ == "__main__":
+    if RUN_MODE == "webhook" and WEBHOOK_WORKERS > 1:
+        supervise(WEBHOOK_WORKERS)
+    else:
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            logger.info("Бот остановлен")
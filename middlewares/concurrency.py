@@ -0,0 +1,69 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Set
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+
+class ConcurrencyMiddleware(BaseMiddleware):
+    """
+    Параллельная обработка апдейтов с сохранением порядка для каждого пользователя
+
+    Регистрируется как outer-middleware на dp.update. Апдейты разных
+    пользователей обрабатываются одновременно, но не больше limit штук
+    сразу; апдейты одного пользователя выполняются строго по очереди
+    (asyncio.Lock отдаёт блокировку в порядке ожидания). Слот общего
+    семафора занимается только после своей очереди пользователя, чтобы
+    ожидающие апдейты не простаивали на глобальном лимите.
+    FSMContextMiddleware диспетчера стоит раньше и читает состояние до
+    очереди, поэтому после своей очереди состояние перечитывается: апдейт
+    видит изменения, сделанные предыдущим апдейтом того же пользователя.
+    Выполняющиеся апдейты запоминаются для drain() при остановке.
+    Блокировки живут в памяти процесса: при WEBHOOK_WORKERS > 1 апдейты
+    одного пользователя, попавшие в разные воркеры, друг друга не ждут.
+    """
+
+    def __init__(self, limit: int = 50):
+        self._semaphore = asyncio.Semaphore(limit)
+        # user_id -> [блокировка, количество апдейтов в очереди]
+        self._locks: Dict[int, list] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def in_flight(self) -> Set[asyncio.Task]:
+        """Апдейты, которые сейчас обрабатываются"""
+        return set(self._tasks)
+
+    async def _run(self, handler, event, data):
+        async with self._semaphore:
+            return await handler(event, data)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            user = data.get('event_from_user')
+            if user is None:
+                return await self._run(handler, event, data)
+            
+            entry = self._locks.get(user.id)
+            if entry is None:
+                entry = self._locks[user.id] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    state = data.get('state')
+                    if state is not None:
+                        data['raw_state'] = await state.get_state()
+                    return await self._run(handler, event, data)
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[user.id]
+        finally:
+            self._tasks.discard(task)
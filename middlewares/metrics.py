@@ -0,0 +1,52 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+
+from services.metrics import handler_errors, handler_seconds
+
+
+def callback_prefix(data: str) -> str:
+    """
+    Префикс callback_data без переменной части
+
+    Берутся ведущие буквенные части до первой с цифрами или id:
+    "buy_5_2" -> "buy", "admin_orders_page_all_120" -> "admin_orders_page_all".
+    """
+    parts = []
+    for part in (data or "").split("_"):
+        if not part.isalpha():
+            break
+        parts.append(part)
+    return "_".join(parts)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Замер времени хендлеров и подсчёт исключений
+
+    Подключается как внутренний middleware роутера, поэтому знает, какой
+    хендлер выбран. Метки: тип события, имя хендлера и для callback-ов
+    префикс callback_data.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        prefix = callback_prefix(event.data) if isinstance(event, CallbackQuery) else ""
+        labels = (type(event).__name__, name, prefix)
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(labels)
+            raise
+        finally:
+            handler_seconds.observe(labels, time.perf_counter() - started)
@@ -0,0 +1,72 @@
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Ограничение частоты callback-запросов по пользователю
+
+    Для каждой пары (правило, пользователь) хранится token bucket из двух
+    чисел: остаток токенов и время последнего обращения. Правило выбирается
+    по самому длинному совпавшему префиксу callback_data. Корзины, к которым
+    давно не обращались, удаляются (после простоя они всё равно полные).
+    Слишком частый callback получает короткий ответ без вызова хендлера.
+    """
+
+    def __init__(self, rules: Dict[str, Tuple[float, float]], idle_ttl: float = 600):
+        # Длинные префиксы проверяются первыми, "" - правило по умолчанию
+        self._rules = sorted(rules.items(), key=lambda rule: len(rule[0]), reverse=True)
+        self._idle_ttl = idle_ttl
+        self._buckets: Dict[Tuple[str, int], list] = {}
+        self._last_sweep = time.monotonic()
+
+    def _match(self, data: str):
+        for prefix, (rate, burst) in self._rules:
+            if data.startswith(prefix):
+                return prefix, rate, burst
+        return None
+
+    def allow(self, user_id: int, data: str) -> bool:
+        """Списать токен; False - запрос нужно отбросить"""
+        rule = self._match(data)
+        if rule is None:
+            return True
+        prefix, rate, burst = rule
+        
+        now = time.monotonic()
+        if now - self._last_sweep > self._idle_ttl:
+            self._sweep(now)
+        
+        key = (prefix, user_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._buckets[key] = [burst - 1, now]
+            return True
+        
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    def _sweep(self, now: float):
+        """Удалить корзины, простаивающие дольше idle_ttl"""
+        idle = [key for key, bucket in self._buckets.items() if now - bucket[1] > self._idle_ttl]
+        for key in idle:
+            del self._buckets[key]
+        self._last_sweep = now
+
+    async def __call__(
+        self,
+        handler: Callable[[CallbackQuery, Dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: Dict[str, Any]
+    ) -> Any:
+        if self.allow(event.from_user.id, event.data or ""):
+            return await handler(event, data)
+        await event.answer("⏳ Слишком часто, подождите немного")
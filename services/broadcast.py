@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+from typing import Dict
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+)
+
+from config import ADMIN_ID, BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_BATCH_SIZE
+from database.db import (
+    get_running_broadcast, get_broadcast, get_user_ids_page, mark_users_blocked,
+    save_broadcast_progress, finish_broadcast
+)
+from services.ratelimit import TokenBucket
+from services.registration import get_registry
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять, не появилась ли новая рассылка, сек
+POLL_INTERVAL = 5
+
+SENT = 'sent'
+FAILED = 'failed'
+BLOCKED = 'blocked'
+
+
+class Broadcaster:
+    """
+    Рассылка копии сообщения админа всем пользователям
+
+    ID пользователей читаются пачками по keyset (user_id > последнего),
+    пачка раздаётся BROADCAST_CONCURRENCY отправителям через очередь.
+    Общий token bucket держит скорость BROADCAST_RATE сообщений в секунду
+    (лимит Telegram - около 30); каждому чату уходит одно сообщение, так что
+    лимит на чат не достигается. TelegramRetryAfter приостанавливает всех
+    отправителей на указанное время, после чего сообщение повторяется.
+    Заблокировавшие бота пользователи помечаются и больше не выбираются.
+
+    После каждой пачки позиция и счётчики сохраняются в broadcasts, поэтому
+    после перезапуска рассылка продолжается с той же пачки (повторно
+    может прийти не больше одной пачки сообщений).
+    """
+
+    def __init__(self, bot: Bot, rate: float = BROADCAST_RATE,
+                 concurrency: int = BROADCAST_CONCURRENCY, batch_size: int = BROADCAST_BATCH_SIZE):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self._bucket = TokenBucket(rate, capacity=1)
+        self._paused_until = 0.0
+
+    async def _wait_pause(self):
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def send(self, broadcast: Dict, user_id: int) -> str:
+        """Отправить копию сообщения одному пользователю"""
+        while True:
+            await self._wait_pause()
+            await self._bucket.acquire()
+            try:
+                await self.bot.copy_message(user_id, broadcast['from_chat_id'], broadcast['message_id'])
+                return SENT
+            except TelegramRetryAfter as e:
+                logger.warning("Рассылка: Telegram просит подождать %s с", e.retry_after)
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            except TelegramForbiddenError:
+                return BLOCKED
+            except TelegramBadRequest as e:
+                if 'chat not found' in e.message.lower():
+                    return BLOCKED
+                logger.warning("Рассылка: ошибка отправки %s: %s", user_id, e)
+                return FAILED
+            except Exception as e:
+                logger.warning("Рассылка: ошибка отправки %s: %s", user_id, e)
+                return FAILED
+
+    async def _send_batch(self, broadcast: Dict, user_ids: list) -> Dict[int, str]:
+        """Отправить пачку через очередь с несколькими отправителями"""
+        queue = asyncio.Queue()
+        for user_id in user_ids:
+            queue.put_nowait(user_id)
+        results = {}
+
+        async def sender():
+            while not queue.empty():
+                user_id = queue.get_nowait()
+                results[user_id] = await self.send(broadcast, user_id)
+
+        await asyncio.gather(*(sender() for _ in range(min(self.concurrency, len(user_ids)))))
+        return results
+
+    async def run_broadcast(self, broadcast: Dict):
+        """Провести рассылку с сохранённой позиции до конца"""
+        broadcast_id = broadcast['id']
+        last_user_id = broadcast['last_user_id']
+        logger.info("Рассылка %s: старт с user_id > %s", broadcast_id, last_user_id)
+
+        while True:
+            # Админ мог остановить рассылку
+            current = await get_broadcast(broadcast_id)
+            if current is None or current['status'] != 'running':
+                logger.info("Рассылка %s остановлена", broadcast_id)
+                return
+
+            user_ids = await get_user_ids_page(last_user_id, self.batch_size)
+            if not user_ids:
+                break
+
+            results = await self._send_batch(broadcast, user_ids)
+            blocked = [user_id for user_id, result in results.items() if result == BLOCKED]
+            if blocked:
+                await mark_users_blocked(blocked)
+                get_registry().forget(blocked)
+
+            last_user_id = user_ids[-1]
+            counts = list(results.values())
+            await save_broadcast_progress(
+                broadcast_id, last_user_id,
+                counts.count(SENT), counts.count(FAILED), len(blocked)
+            )
+
+        if await finish_broadcast(broadcast_id):
+            await self.notify_admin(broadcast_id)
+
+    async def notify_admin(self, broadcast_id: int):
+        """Сообщить админу итоги рассылки"""
+        broadcast = await get_broadcast(broadcast_id)
+        try:
+            await self.bot.send_message(ADMIN_ID, broadcast_report(broadcast))
+        except Exception as e:
+            logger.warning("Не удалось отправить итоги рассылки: %s", e)
+
+    async def run(self):
+        """Бесконечный цикл: продолжить незавершённую рассылку или дождаться новой"""
+        while True:
+            try:
+                broadcast = await get_running_broadcast()
+                if broadcast is not None:
+                    await self.run_broadcast(broadcast)
+                    continue
+            except Exception:
+                logger.exception("Ошибка рассылки")
+            await asyncio.sleep(POLL_INTERVAL)
+
+
+def broadcast_report(broadcast: Dict) -> str:
+    """Текст с состоянием рассылки"""
+    status = {
+        'running': "⏳ Идёт",
+        'done': "✅ Завершена",
+        'canceled': "⛔ Остановлена",
+    }.get(broadcast['status'], broadcast['status'])
+    return (
+        f"📢 <b>Рассылка #{broadcast['id']}</b>\n\n"
+        f"Статус: {status}\n"
+        f"✉️ Доставлено: {broadcast['sent']}\n"
+        f"🚫 Заблокировали бота: {broadcast['blocked']}\n"
+        f"❗ Ошибок: {broadcast['failed']}\n"
+        f"🕒 Начата: {broadcast['created_at'][:16]}"
+    )
+
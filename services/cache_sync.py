@@ -0,0 +1,38 @@
+import asyncio
+import logging
+
+from database.cache import VersionedCache
+from database.db import get_cache_version, bump_cache_version
+
+logger = logging.getLogger(__name__)
+
+
+async def run_cache_sync(cache: VersionedCache, name: str, interval: float = 1):
+    """
+    Согласование кэша между процессами бота
+
+    Раз в interval секунд локальные изменения публикуются увеличением
+    общей версии в cache_versions, а если версию увеличил другой процесс -
+    локальный кэш сбрасывается. Каталог в соседнем процессе устаревает
+    не дольше чем на пару интервалов; сами выдачи от кэша не зависят.
+    """
+    seen = await get_cache_version(name)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if cache.take_unpublished():
+                try:
+                    version = await bump_cache_version(name)
+                except Exception:
+                    cache.bump()  # опубликовать на следующем проходе
+                    raise
+                # Между нашими проверками версию мог поднять кто-то ещё
+                if version != seen + 1:
+                    cache.invalidate()
+            else:
+                version = await get_cache_version(name)
+                if version != seen:
+                    cache.invalidate()
+            seen = version
+        except Exception:
+            logger.exception("Ошибка синхронизации кэша %s", name)
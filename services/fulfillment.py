@@ -0,0 +1,121 @@
+import asyncio
+from typing import Dict, List, Set
+
+from aiogram import Bot
+from aiogram.types import BufferedInputFile
+
+from config import DELIVERY_INLINE_MAX_ITEMS
+from database.db import begin_fulfillment, complete_fulfillment
+from database.models import CLAIMED, OUT_OF_STOCK
+
+# Выдачи, которые нужно довести до конца перед остановкой бота
+_inflight: Set[asyncio.Task] = set()
+
+
+def in_flight() -> Set[asyncio.Task]:
+    """Выполняющиеся выдачи товара"""
+    return set(_inflight)
+
+
+async def _shielded(coro):
+    """
+    Выполнить выдачу в отдельной задаче, не прерываемой отменой вызывающего
+    
+    Отмена фоновой сверки при остановке не обрывает отправку товара
+    на середине; main дожидается таких задач через in_flight().
+    """
+    task = asyncio.create_task(coro)
+    _inflight.add(task)
+    task.add_done_callback(_inflight.discard)
+    return await asyncio.shield(task)
+
+
+def file_caption(product: Dict) -> str:
+    """Подпись к выданному файлу"""
+    return f"✅ <b>Оплата прошла успешно!</b>\n\nВаш файл: {product['name']}\n\nСпасибо за покупку! 🎉"
+
+
+def item_text(items: List[str]) -> str:
+    """Сообщение с выданными текстовыми единицами товара"""
+    items = "\n".join(items)
+    return f"""
+✅ <b>Оплата прошла успешно!</b>
+
+Ваш товар:
+<code>{items}</code>
+
+Спасибо за покупку! 🎉
+"""
+
+
+def as_document(items: List[str]) -> bool:
+    """Слишком много единиц для одного сообщения - выдавать .txt-файлом"""
+    return len(items) > DELIVERY_INLINE_MAX_ITEMS or sum(len(item) + 1 for item in items) > 3500
+
+
+def items_document(items: List[str]) -> BufferedInputFile:
+    """Сформированный .txt-файл с выданными единицами (по одной на строку)"""
+    return BufferedInputFile("\n".join(items).encode(), filename=f"order_{len(items)}_items.txt")
+
+
+def items_caption(product: Dict, count: int) -> str:
+    """Подпись к файлу с выданными единицами"""
+    return f"✅ <b>Оплата прошла успешно!</b>\n\n{product['name']} × {count} - в файле.\n\nСпасибо за покупку! 🎉"
+
+
+async def fulfill_payment(payment_id: str) -> Dict:
+    """
+    Закрепить товар за оплаченным заказом
+    
+    Вызывается как из кнопки "Проверить оплату", так и из уведомления
+    ЮKassa и фоновой сверки. Заказ переходит в fulfilling вместе с
+    выдачей всех его единиц стока одной транзакцией, поэтому параллельные
+    вызовы не выдадут ключи повторно. При статусе CLAIMED вызывающий отправляет
+    товар и затем вызывает complete_fulfillment(order['id']).
+    
+    Returns:
+        dict со статусом (status), заказом, товаром и закреплёнными единицами (items)
+    """
+    return await begin_fulfillment(payment_id)
+
+
+async def send_items(bot: Bot, chat_id: int, product: Dict, items: List[str]):
+    """Отправить выданный товар покупателю новыми сообщениями"""
+    if product['product_type'] == 'file':
+        for item in items:
+            await bot.send_document(chat_id, document=item, caption=file_caption(product))
+    elif as_document(items):
+        await bot.send_document(
+            chat_id, document=items_document(items), caption=items_caption(product, len(items))
+        )
+    else:
+        await bot.send_message(chat_id, item_text(items))
+
+
+async def fulfill_and_notify(bot: Bot, payment_id: str) -> Dict:
+    """Выдать товар по оплаченному платежу и отправить его покупателю"""
+    return await _shielded(_fulfill_and_notify(bot, payment_id))
+
+
+async def _fulfill_and_notify(bot: Bot, payment_id: str) -> Dict:
+    result = await fulfill_payment(payment_id)
+    order = result['order']
+    
+    if result['status'] == CLAIMED:
+        await send_items(bot, order['user_id'], result['product'], result['items'])
+        await complete_fulfillment(order['id'])
+    elif result['status'] == OUT_OF_STOCK:
+        await bot.send_message(order['user_id'], "❌ Товар закончился! Свяжитесь с поддержкой.")
+    
+    return result
+
+
+async def redeliver(bot: Bot, order: Dict):
+    """Повторно отправить закреплённый товар заказа, застрявшего в fulfilling"""
+    await _shielded(_redeliver(bot, order))
+
+
+async def _redeliver(bot: Bot, order: Dict):
+    product = {'name': order['product_name'], 'product_type': order['product_type']}
+    await send_items(bot, order['user_id'], product, order['items'])
+    await complete_fulfillment(order['id'])
@@ -0,0 +1,212 @@
+"""Метрики бота в формате Prometheus.
+
+Гистограммы задержек и счётчики ошибок для хендлеров, функций
+database.models и запросов к ЮKassa. Запись не берёт блокировок: у
+каждого потока (event loop, пул чтения, писатель) свой набор счётчиков,
+которые складываются только при выдаче /metrics. Кроме бакетов для
+histogram_quantile отдаются готовые p50/p99, оценённые по тем же бакетам.
+"""
+import functools
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+from aiohttp import web
+
+# Границы бакетов задержки, сек
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUANTILES = (0.5, 0.99)
+
+_metrics = []
+
+
+class _Sharded:
+    """Данные метрики по потокам: поток пишет только в свой словарь"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...]):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._local = threading.local()
+        self._shards: List[Dict[tuple, list]] = []
+        self._register_lock = threading.Lock()
+        _metrics.append(self)
+
+    def _shard(self) -> Dict[tuple, list]:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            # Один раз на поток
+            shard = self._local.shard = {}
+            with self._register_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _labels(self, labels: tuple, **extra) -> str:
+        pairs = list(zip(self.labelnames, labels)) + list(extra.items())
+        if not pairs:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def _merged(self, size: int) -> Dict[tuple, list]:
+        merged = {}
+        for shard in list(self._shards):
+            for labels, row in list(shard.items()):
+                total = merged.setdefault(labels, [0] * size)
+                for i, value in enumerate(row):
+                    total[i] += value
+        return merged
+
+
+class Counter(_Sharded):
+    """Счётчик событий"""
+
+    def inc(self, labels: tuple = (), value: float = 1):
+        shard = self._shard()
+        row = shard.get(labels)
+        if row is None:
+            row = shard[labels] = [0]
+        row[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, (value,) in sorted(self._merged(1).items()):
+            lines.append(f"{self.name}{self._labels(labels)} {value}")
+        return lines
+
+
+class Histogram(_Sharded):
+    """Гистограмма задержек с фиксированными бакетами"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...], buckets=BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = buckets
+
+    def observe(self, labels: tuple, value: float):
+        shard = self._shard()
+        row = shard.get(labels)
+        if row is None:
+            # счётчики бакетов (последний - больше всех границ) и сумма
+            row = shard[labels] = [0] * (len(self.buckets) + 2)
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def quantile(self, counts: list, q: float) -> float:
+        """Оценка квантиля по бакетам (линейно внутри бакета, как histogram_quantile)"""
+        total = sum(counts)
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0
+                if i == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return 0.0
+
+    def render(self) -> List[str]:
+        name = self.name
+        lines = [f"# HELP {name} {self.help}", f"# TYPE {name} histogram"]
+        merged = sorted(self._merged(len(self.buckets) + 2).items())
+        for labels, row in merged:
+            counts, total_time = row[:-1], row[-1]
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._labels(labels, le=bound)} {cumulative}")
+            cumulative += counts[-1]
+            lines.append(f'{name}_bucket{self._labels(labels, le="+Inf")} {cumulative}')
+            lines.append(f"{name}_sum{self._labels(labels)} {total_time}")
+            lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+
+        lines.append(f"# HELP {name}_quantile {self.help} (оценка p50/p99 по бакетам)")
+        lines.append(f"# TYPE {name}_quantile gauge")
+        for labels, row in merged:
+            for q in QUANTILES:
+                value = self.quantile(row[:-1], q)
+                lines.append(f"{name}_quantile{self._labels(labels, quantile=q)} {value}")
+        return lines
+
+
+handler_seconds = Histogram(
+    "bot_handler_seconds", "Время обработки апдейта хендлером", ("event", "handler", "prefix")
+)
+handler_errors = Counter(
+    "bot_handler_errors_total", "Исключения в хендлерах", ("event", "handler", "prefix")
+)
+db_seconds = Histogram("bot_db_seconds", "Время выполнения функций database.models", ("function",))
+db_errors = Counter("bot_db_errors_total", "Исключения в функциях database.models", ("function",))
+payment_seconds = Histogram("bot_payment_seconds", "Время запросов к ЮKassa", ("method",))
+payment_errors = Counter("bot_payment_errors_total", "Ошибки запросов к ЮKassa", ("method",))
+
+
+def timed(histogram: Histogram, errors: Counter, labels: tuple):
+    """Декоратор замера синхронной функции"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                errors.inc(labels)
+                raise
+            finally:
+                histogram.observe(labels, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def timed_async(histogram: Histogram, errors: Counter, labels: tuple):
+    """Декоратор замера корутины"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.inc(labels)
+                raise
+            finally:
+                histogram.observe(labels, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def instrument_module(namespace: dict, module_name: str, exclude=()):
+    """Обернуть замером все функции модуля (кроме exclude) в его же пространстве имён"""
+    for name, value in list(namespace.items()):
+        if (callable(value) and getattr(value, '__module__', None) == module_name
+                and not name.startswith('_') and name not in exclude
+                and not isinstance(value, type)):
+            namespace[name] = timed(db_seconds, db_errors, (name,))(value)
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Prometheus-Format": "0.0.4"})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Поднять HTTP-сервер с GET /metrics, вернуть runner для остановки"""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError:
+        await runner.cleanup()
+        raise
+    return runner
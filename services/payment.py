@@ -1,9 +1,121 @@
-import uuid
-import requests
+import asyncio
 import base64
-from config import YUKASSA_TOKEN, YUKASSA_SHOP_ID
+import random
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import aiohttp
+
+from config import (
+    YUKASSA_TOKEN, YUKASSA_SHOP_ID, YUKASSA_TIMEOUT, YUKASSA_MAX_RETRIES,
+    PAYMENT_PENDING_TTL, PAYMENT_CACHE_SIZE
+)
+from services.metrics import payment_errors, payment_seconds, timed_async
+
+API_URL = "https://api.yookassa.ru/v3/payments"
+
+# Статусы, при которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Окончательные статусы платежа: больше не меняются, кэшируются навсегда
+TERMINAL_STATUSES = {'succeeded', 'canceled'}
+
+
+class PaymentError(Exception):
+    """Ошибка обращения к API ЮKassa"""
+
+
+class YooKassaClient:
+    """
+    Асинхронный клиент ЮKassa
+
+    Держит одну сессию aiohttp (keep-alive пул соединений) на всё время
+    работы процесса, повторяет запросы при 429/5xx и сетевых ошибках
+    с экспоненциальной задержкой и джиттером.
+    """
+
+    def __init__(self, shop_id: str, secret_key: str, timeout: float = 10,
+                 max_retries: int = 3, backoff_base: float = 0.5):
+        auth_bytes = f"{shop_id}:{secret_key}".encode('utf-8')
+        self._auth_header = f"Basic {base64.b64encode(auth_bytes).decode('utf-8')}"
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=self._timeout,
+                connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=60),
+                headers={"Authorization": self._auth_header}
+            )
+        return self._session
+
+    def _backoff(self, attempt: int) -> float:
+        """Задержка перед повтором: full jitter"""
+        return random.uniform(0, self._backoff_base * (2 ** attempt))
+
+    async def request(self, method: str, url: str, payload: dict = None,
+                      idempotence_key: str = None) -> dict:
+        """
+        Выполнить запрос к API с повторами
+
+        Повторные попытки используют тот же Idempotence-Key, поэтому
+        ЮKassa не создаст второй платёж.
+        """
+        headers = {}
+        if idempotence_key:
+            headers["Idempotence-Key"] = idempotence_key
+
+        session = self._get_session()
+        for attempt in range(self._max_retries + 1):
+            last_attempt = attempt == self._max_retries
+            try:
+                async with session.request(method, url, json=payload, headers=headers) as response:
+                    if response.status == 200:
+                        return await response.json()
+                    text = await response.text()
+                    if response.status not in RETRY_STATUSES or last_attempt:
+                        raise PaymentError(text)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if last_attempt:
+                    raise PaymentError(str(e) or e.__class__.__name__) from e
+            await asyncio.sleep(self._backoff(attempt))
+
+    async def close(self):
+        """Закрыть сессию"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+_client: Optional[YooKassaClient] = None
+
+
+def get_client() -> YooKassaClient:
+    """Получить общий клиент ЮKassa"""
+    global _client
+    if _client is None:
+        _client = YooKassaClient(
+            YUKASSA_SHOP_ID, YUKASSA_TOKEN,
+            timeout=YUKASSA_TIMEOUT, max_retries=YUKASSA_MAX_RETRIES
+        )
+    return _client
+
+
+async def close_client():
+    """Закрыть общий клиент ЮKassa"""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
 
-def create_payment(amount: float, description: str, return_url: str = None) -> dict:
+
+@timed_async(payment_seconds, payment_errors, ('create_payment',))
+async def create_payment(amount: float, description: str, return_url: str = None) -> dict:
     """
     Создать платеж в ЮKassa
     
@@ -15,22 +127,9 @@ def create_payment(amount: float, description: str, return_url: str = None) -> d
     Returns:
         dict с данными платежа (id, confirmation_url)
     """
-    url = "https://api.yookassa.ru/v3/payments"
-    
     # Генерация уникального ключа идемпотентности
     idempotence_key = str(uuid.uuid4())
     
-    # Базовая аутентификация
-    auth_string = f"{YUKASSA_SHOP_ID}:{YUKASSA_TOKEN}"
-    auth_bytes = auth_string.encode('utf-8')
-    auth_base64 = base64.b64encode(auth_bytes).decode('utf-8')
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Idempotence-Key": idempotence_key,
-        "Authorization": f"Basic {auth_base64}"
-    }
-    
     payload = {
         "amount": {
             "value": f"{amount:.2f}",
@@ -44,47 +143,105 @@ def create_payment(amount: float, description: str, return_url: str = None) -> d
         "description": description
     }
     
-    response = requests.post(url, json=payload, headers=headers)
+    try:
+        data = await get_client().request("POST", API_URL, payload, idempotence_key)
+    except PaymentError as e:
+        raise PaymentError(f"Ошибка создания платежа: {e}") from e
     
-    if response.status_code == 200:
-        data = response.json()
-        return {
-            "payment_id": data["id"],
-            "confirmation_url": data["confirmation"]["confirmation_url"],
-            "status": data["status"]
-        }
-    else:
-        raise Exception(f"Ошибка создания платежа: {response.text}")
-
-def check_payment(payment_id: str) -> dict:
+    return {
+        "payment_id": data["id"],
+        "confirmation_url": data["confirmation"]["confirmation_url"],
+        "status": data["status"]
+    }
+
+class PaymentStatusCache:
+    """
+    Кэш статусов платежей
+
+    Окончательные статусы хранятся, пока не вытеснены из LRU
+    (PAYMENT_CACHE_SIZE записей), остальные - PAYMENT_PENDING_TTL секунд.
+    """
+
+    def __init__(self, pending_ttl: float, max_size: int):
+        self.pending_ttl = pending_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def get(self, payment_id: str) -> Optional[dict]:
+        entry = self._entries.get(payment_id)
+        if entry is None:
+            return None
+        expires_at, payment = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._entries[payment_id]
+            return None
+        self._entries.move_to_end(payment_id)
+        return payment
+
+    def put(self, payment: dict):
+        if payment['status'] in TERMINAL_STATUSES:
+            expires_at = None
+        else:
+            expires_at = time.monotonic() + self.pending_ttl
+        self._entries[payment['payment_id']] = (expires_at, payment)
+        self._entries.move_to_end(payment['payment_id'])
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+_status_cache = PaymentStatusCache(PAYMENT_PENDING_TTL, PAYMENT_CACHE_SIZE)
+
+# Запросы статуса, которые сейчас выполняются (payment_id -> задача)
+_inflight: Dict[str, asyncio.Task] = {}
+
+
+def parse_payment(data: dict) -> dict:
+    """Привести объект платежа ЮKassa к виду, который возвращает check_payment"""
+    return {
+        "payment_id": data["id"],
+        "status": data["status"],
+        "paid": data["paid"],
+        "amount": float(data["amount"]["value"])
+    }
+
+
+# Замеряется сам запрос к API: попадания в кэш и ожидание чужого запроса
+# не должны занижать задержку ЮKassa
+@timed_async(payment_seconds, payment_errors, ('check_payment',))
+async def _fetch_payment(payment_id: str) -> dict:
+    try:
+        data = await get_client().request("GET", f"{API_URL}/{payment_id}")
+    except PaymentError as e:
+        raise PaymentError(f"Ошибка проверки платежа: {e}") from e
+    
+    payment = parse_payment(data)
+    _status_cache.put(payment)
+    return payment
+
+async def check_payment(payment_id: str, fresh: bool = False) -> dict:
     """
     Проверить статус платежа
     
+    Одновременные проверки одного платежа разделяют один запрос к API,
+    свежий результат отдаётся из кэша.
+    
     Args:
         payment_id: ID платежа в ЮKassa
+        fresh: не доверять кэшу неокончательного статуса (уведомление
+            сообщило об изменении - спросить API заново)
     
     Returns:
         dict со статусом платежа
     """
-    url = f"https://api.yookassa.ru/v3/payments/{payment_id}"
-    
-    auth_string = f"{YUKASSA_SHOP_ID}:{YUKASSA_TOKEN}"
-    auth_bytes = auth_string.encode('utf-8')
-    auth_base64 = base64.b64encode(auth_bytes).decode('utf-8')
-    
-    headers = {
-        "Authorization": f"Basic {auth_base64}"
-    }
+    payment = _status_cache.get(payment_id)
+    if payment is not None and (not fresh or payment['status'] in TERMINAL_STATUSES):
+        return payment
     
-    response = requests.get(url, headers=headers)
+    task = _inflight.get(payment_id)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_payment(payment_id))
+        _inflight[payment_id] = task
+        task.add_done_callback(lambda _: _inflight.pop(payment_id, None))
     
-    if response.status_code == 200:
-        data = response.json()
-        return {
-            "payment_id": data["id"],
-            "status": data["status"],
-            "paid": data["paid"],
-            "amount": float(data["amount"]["value"])
-        }
-    else:
-        raise Exception(f"Ошибка проверки платежа: {response.text}")
\ No newline at end of file
+    # shield: отмена одного ожидающего не отменяет общий запрос
+    return await asyncio.shield(task)
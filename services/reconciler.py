@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict
+
+from aiogram import Bot
+
+from config import (
+    RECONCILE_INTERVAL, RECONCILE_BATCH_SIZE, RECONCILE_CONCURRENCY,
+    RECONCILE_RATE, RECONCILE_MIN_AGE, ORDER_EXPIRE_MINUTES, FULFILLMENT_TIMEOUT,
+    FULFILLMENT_MAX_ATTEMPTS, CLOSED_ORDER_RECHECK_HOURS
+)
+from database.db import (
+    get_pending_orders, get_closed_unpaid_orders, get_stale_fulfillments,
+    record_delivery_failure, update_order_status, close_payment_link
+)
+from services.fulfillment import fulfill_and_notify, redeliver
+from services.payment import check_payment
+from services.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+def is_expired(order: Dict) -> bool:
+    """Заказ висит в ожидании дольше ORDER_EXPIRE_MINUTES"""
+    created_at = datetime.strptime(order['created_at'], "%Y-%m-%d %H:%M:%S")
+    return datetime.utcnow() - created_at > timedelta(minutes=ORDER_EXPIRE_MINUTES)
+
+
+class Reconciler:
+    """
+    Фоновая сверка неоплаченных заказов с ЮKassa
+
+    Выдаёт товар по оплаченным платежам, о которых бот не узнал
+    (покупатель не нажал "Проверить оплату", уведомление потерялось),
+    закрывает отменённые и просроченные заказы (и выдаёт товар, если их
+    платёж всё же оплатили в течение CLOSED_ORDER_RECHECK_HOURS), довыдаёт заказы,
+    застрявшие в fulfilling дольше FULFILLMENT_TIMEOUT (после
+    FULFILLMENT_MAX_ATTEMPTS неудач заказ уходит в failed). Запросы к ЮKassa
+    ограничены собственным бюджетом (RECONCILE_RATE в секунду), чтобы
+    не вытеснять интерактивные проверки.
+    """
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._limiter = TokenBucket(RECONCILE_RATE)
+        self._semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+
+    async def reconcile_order(self, order: Dict):
+        """Сверить один заказ"""
+        async with self._semaphore:
+            await self._limiter.acquire()
+            try:
+                payment_info = await check_payment(order['payment_id'])
+            except Exception as e:
+                logger.warning("Сверка заказа %s не удалась: %s", order['id'], e)
+                return
+            
+            if payment_info['status'] == 'succeeded' and payment_info['paid']:
+                result = await fulfill_and_notify(self.bot, order['payment_id'])
+                logger.info("Заказ %s досверен: %s", order['id'], result['status'])
+            elif payment_info['status'] == 'canceled':
+                await update_order_status(order['payment_id'], 'canceled', from_status='pending')
+                await close_payment_link(order['payment_id'])
+            elif is_expired(order):
+                await update_order_status(order['payment_id'], 'expired', from_status='pending')
+
+    async def reconcile_pending(self):
+        """Пройти по всем ожидающим заказам пачками"""
+        after_id = 0
+        while True:
+            orders = await get_pending_orders(after_id, RECONCILE_BATCH_SIZE, RECONCILE_MIN_AGE)
+            if not orders:
+                break
+            await asyncio.gather(*(self.reconcile_order(order) for order in orders))
+            after_id = orders[-1]['id']
+
+    async def reconcile_closed(self):
+        """
+        Отменённые и просроченные заказы с открытым платежом: платёж ЮKassa
+        при отмене заказа остаётся оплачиваемым, оплаченный выдаётся
+        """
+        after_id = 0
+        while True:
+            orders = await get_closed_unpaid_orders(after_id, RECONCILE_BATCH_SIZE,
+                                                    CLOSED_ORDER_RECHECK_HOURS)
+            if not orders:
+                break
+            await asyncio.gather(*(self.reconcile_order(order) for order in orders))
+            after_id = orders[-1]['id']
+
+    async def redeliver_order(self, order: Dict):
+        """Довыдать один заказ, неудачи учитываются"""
+        try:
+            await redeliver(self.bot, order)
+            logger.info("Заказ %s довыдан после сбоя", order['id'])
+        except Exception as e:
+            if await record_delivery_failure(order['id'], FULFILLMENT_MAX_ATTEMPTS):
+                logger.error("Заказ %s не удалось довыдать за %s попыток, переведён в failed: %s",
+                             order['id'], FULFILLMENT_MAX_ATTEMPTS, e)
+            else:
+                logger.warning("Не удалось довыдать заказ %s: %s", order['id'], e)
+
+    async def redeliver_stale(self):
+        """Довыдать заказы, застрявшие между закреплением товара и отправкой (пачками по id)"""
+        after_id = 0
+        while True:
+            orders = await get_stale_fulfillments(FULFILLMENT_TIMEOUT, RECONCILE_BATCH_SIZE, after_id)
+            if not orders:
+                break
+            for order in orders:
+                await self.redeliver_order(order)
+            after_id = orders[-1]['id']
+
+    async def run(self):
+        """Бесконечный цикл сверки"""
+        while True:
+            try:
+                await self.redeliver_stale()
+                await self.reconcile_pending()
+                await self.reconcile_closed()
+            except Exception:
+                logger.exception("Ошибка фоновой сверки заказов")
+            await asyncio.sleep(RECONCILE_INTERVAL)
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from aiogram.types import User
+
+from config import USER_CACHE_SIZE, USER_FLUSH_INTERVAL
+from database.db import upsert_users
+
+logger = logging.getLogger(__name__)
+
+
+class UserRegistry:
+    """
+    Буферизованная регистрация пользователей
+
+    Недавно виденные пользователи хранятся в ограниченном LRU вместе с
+    профилем (username, имя, фамилия). Повторный /start известного
+    пользователя с неизменным профилем не трогает БД. Новые и изменившиеся
+    профили копятся в буфере и записываются одной пачкой раз в
+    USER_FLUSH_INTERVAL секунд.
+
+    Заблокировавших бота рассылка отмечает в БД и убирает из LRU (forget),
+    чтобы их следующий /start снова записал профиль и снял отметку. При
+    нескольких воркерах это публикуется через run_cache_sync, и соседние
+    процессы забывают известных пользователей.
+    """
+
+    def __init__(self, max_known: int = 100000, flush_interval: float = 2):
+        self.max_known = max_known
+        self.flush_interval = flush_interval
+        self._known = OrderedDict()
+        self._pending = {}
+        self._unpublished = False
+
+    def touch(self, user: User):
+        """Отметить пользователя (без обращения к БД)"""
+        profile = (user.username, user.first_name, user.last_name)
+        
+        if self._known.get(user.id) == profile:
+            self._known.move_to_end(user.id)
+            return
+        
+        self._known[user.id] = profile
+        self._known.move_to_end(user.id)
+        if len(self._known) > self.max_known:
+            self._known.popitem(last=False)
+        
+        self._pending[user.id] = profile
+
+    def forget(self, user_ids):
+        """Забыть пользователей: следующий /start снова запишет их в БД"""
+        for user_id in user_ids:
+            self._known.pop(user_id, None)
+        self._unpublished = True
+
+    # Интерфейс для run_cache_sync (как у VersionedCache)
+
+    def bump(self):
+        self._unpublished = True
+
+    def take_unpublished(self) -> bool:
+        unpublished, self._unpublished = self._unpublished, False
+        return unpublished
+
+    def invalidate(self):
+        """Другой процесс забыл пользователей - забыть всех известных"""
+        self._known.clear()
+
+    async def flush(self):
+        """Записать накопленных пользователей одной пачкой"""
+        if not self._pending:
+            return
+        
+        pending, self._pending = self._pending, {}
+        rows = [(user_id, *profile) for user_id, profile in pending.items()]
+        try:
+            await upsert_users(rows)
+        except Exception:
+            # Вернуть в буфер, не затирая более свежие профили
+            for user_id, profile in pending.items():
+                self._pending.setdefault(user_id, profile)
+            raise
+
+    async def run(self):
+        """Периодическая запись буфера"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Ошибка записи пользователей")
+
+
+_registry: Optional[UserRegistry] = None
+
+
+def get_registry() -> UserRegistry:
+    """Получить общий реестр пользователей"""
+    global _registry
+    if _registry is None:
+        _registry = UserRegistry(USER_CACHE_SIZE, USER_FLUSH_INTERVAL)
+    return _registry
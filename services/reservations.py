@@ -0,0 +1,32 @@
+import asyncio
+import logging
+
+from config import RESERVATION_SWEEP_INTERVAL
+from database.db import release_expired_reservations
+
+logger = logging.getLogger(__name__)
+
+# Сколько резервов снимать одной транзакцией
+SWEEP_BATCH_SIZE = 500
+
+
+async def sweep_expired_reservations() -> int:
+    """Вернуть в сток все просроченные резервы (пачками)"""
+    total = 0
+    while True:
+        released = await release_expired_reservations(SWEEP_BATCH_SIZE)
+        total += released
+        if released < SWEEP_BATCH_SIZE:
+            return total
+
+
+async def run_reservation_sweeper():
+    """Периодическая очистка просроченных резервов стока"""
+    while True:
+        try:
+            released = await sweep_expired_reservations()
+            if released:
+                logger.info("Снято просроченных резервов: %s", released)
+        except Exception:
+            logger.exception("Ошибка очистки резервов")
+        await asyncio.sleep(RESERVATION_SWEEP_INTERVAL)
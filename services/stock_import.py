@@ -0,0 +1,93 @@
+import codecs
+import csv
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from aiogram import Bot
+from aiogram.types import Document
+
+from config import STOCK_IMPORT_CHUNK_SIZE
+from database.db import add_stock_items
+
+# Какие документы принимаются как список ключей
+IMPORT_EXTENSIONS = ('.txt', '.csv')
+
+# Как часто обновлять сообщение с прогрессом, сек
+PROGRESS_INTERVAL = 2
+
+
+def is_importable(document: Document) -> bool:
+    """Документ - текстовый список ключей"""
+    return (document.file_name or "").lower().endswith(IMPORT_EXTENSIONS)
+
+
+async def iter_document_lines(bot: Bot, document: Document) -> AsyncIterator[str]:
+    """Построчно читать документ, скачивая его по частям"""
+    file = await bot.get_file(document.file_id)
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    tail = ""
+    async for chunk in bot.session.stream_content(url, timeout=300):
+        lines = (tail + decoder.decode(chunk)).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line
+    
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+async def iter_stock_items(lines: AsyncIterator[str], is_csv: bool) -> AsyncIterator[str]:
+    """Ключи из строк документа (для CSV - первая колонка)"""
+    async for line in lines:
+        if is_csv:
+            row = next(csv.reader([line]), None)
+            line = row[0] if row else ""
+        line = line.strip()
+        if line:
+            yield line
+
+
+async def import_stock_document(
+    bot: Bot,
+    product_id: int,
+    document: Document,
+    on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None
+) -> tuple:
+    """
+    Загрузить ключи из документа в сток товара
+    
+    Файл не держится в памяти целиком: ключи читаются потоком и
+    записываются пачками по STOCK_IMPORT_CHUNK_SIZE, каждая в своей
+    транзакции. Дубликаты (уже загруженные ключи) пропускаются.
+    
+    Returns:
+        (добавлено, прочитано) ключей
+    """
+    is_csv = document.file_name.lower().endswith('.csv')
+    lines = iter_document_lines(bot, document)
+    
+    added = read = 0
+    chunk = []
+    last_progress = time.monotonic()
+    
+    async for item in iter_stock_items(lines, is_csv):
+        chunk.append(item)
+        if len(chunk) < STOCK_IMPORT_CHUNK_SIZE:
+            continue
+        
+        added += await add_stock_items(product_id, chunk)
+        read += len(chunk)
+        chunk = []
+        
+        if on_progress and time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+            await on_progress(added, read)
+            last_progress = time.monotonic()
+    
+    if chunk:
+        added += await add_stock_items(product_id, chunk)
+        read += len(chunk)
+    
+    return added, read
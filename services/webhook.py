@@ -0,0 +1,172 @@
+import asyncio
+import ipaddress
+import logging
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT,
+    YUKASSA_WEBHOOK_PATH, YUKASSA_WEBHOOK_IPS, TRUSTED_PROXIES
+)
+from database.db import get_order_by_payment, update_order_status, close_payment_link
+from services.fulfillment import fulfill_and_notify
+from services.payment import check_payment
+
+logger = logging.getLogger(__name__)
+
+
+def parse_networks(value: str) -> list:
+    """Список сетей из строки через запятую"""
+    return [ipaddress.ip_network(net.strip()) for net in value.split(",") if net.strip()]
+
+
+TRUSTED_NETWORKS = parse_networks(YUKASSA_WEBHOOK_IPS)
+PROXY_NETWORKS = parse_networks(TRUSTED_PROXIES)
+
+
+def in_networks(remote: str, networks: list) -> bool:
+    try:
+        address = ipaddress.ip_address(remote)
+    except (TypeError, ValueError):
+        return False
+    return any(address in network for network in networks)
+
+
+def is_trusted_ip(remote: str) -> bool:
+    """Проверить, что уведомление пришло с адреса ЮKassa"""
+    return in_networks(remote, TRUSTED_NETWORKS)
+
+
+def client_ip(request: web.Request) -> str:
+    """
+    Адрес отправителя запроса
+    
+    Если запрос пришёл от своего прокси (TRUSTED_PROXIES), берётся
+    ближайший к нам адрес X-Forwarded-For, не принадлежащий прокси:
+    более левые адреса клиент может подставить сам.
+    """
+    remote = request.remote
+    if not in_networks(remote, PROXY_NETWORKS):
+        return remote
+    forwarded = [part.strip() for part in request.headers.get("X-Forwarded-For", "").split(",") if part.strip()]
+    for address in reversed(forwarded):
+        if not in_networks(address, PROXY_NETWORKS):
+            return address
+    return remote
+
+
+async def handle_payment_succeeded(bot: Bot, payment_id: str):
+    """Выдать товар по уведомлению payment.succeeded (статус и сумма - из API)"""
+    order = await get_order_by_payment(payment_id)
+    if not order:
+        logger.warning("Уведомление по неизвестному платежу %s", payment_id)
+        return
+    
+    payment = await check_payment(payment_id, fresh=True)
+    if payment['status'] != 'succeeded' or not payment['paid']:
+        logger.warning("Уведомление об оплате %s не подтверждено API (статус %s)",
+                       payment_id, payment['status'])
+        return
+    
+    if payment['amount'] < order['price']:
+        logger.warning("Сумма платежа %s меньше стоимости заказа %s", payment_id, order['id'])
+        return
+    
+    await fulfill_and_notify(bot, payment_id)
+
+
+async def handle_payment_canceled(payment_id: str):
+    """Отметить заказ отменённым по уведомлению payment.canceled (если API подтверждает)"""
+    payment = await check_payment(payment_id, fresh=True)
+    if payment['status'] == 'canceled':
+        await update_order_status(payment_id, 'canceled', from_status='pending')
+        await close_payment_link(payment_id)
+
+
+async def yookassa_notification(request: web.Request) -> web.Response:
+    """
+    Обработчик HTTP-уведомлений ЮKassa
+    
+    Тело уведомления - только подсказка, какой платёж проверить: статус
+    и сумма всегда запрашиваются у API ЮKassa.
+    """
+    remote = client_ip(request)
+    if not is_trusted_ip(remote):
+        logger.warning("Уведомление ЮKassa с недоверенного адреса %s", remote)
+        return web.Response(status=403)
+    
+    try:
+        notification = await request.json()
+        event = notification['event']
+        payment_id = str(notification['object']['id'])
+    except (ValueError, KeyError, TypeError):
+        return web.Response(status=400)
+    
+    bot: Bot = request.app['bot']
+    
+    try:
+        if event == 'payment.succeeded':
+            await handle_payment_succeeded(bot, payment_id)
+        elif event == 'payment.canceled':
+            await handle_payment_canceled(payment_id)
+    except Exception:
+        # Код не 200 заставит ЮKassa повторить уведомление
+        logger.exception("Ошибка обработки уведомления %s по платежу %s", event, payment_id)
+        return web.Response(status=500)
+    
+    return web.Response(status=200)
+
+
+def create_app(bot: Bot, dp: Dispatcher) -> web.Application:
+    """Создать aiohttp-приложение с вебхуками Telegram и ЮKassa"""
+    app = web.Application()
+    app['bot'] = bot
+    
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET
+    ).register(app, path=WEBHOOK_PATH)
+    app.router.add_post(YUKASSA_WEBHOOK_PATH, yookassa_notification)
+    
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, set_webhook: bool = True, reuse_port: bool = False):
+    """
+    Запустить бот в режиме вебхука
+    
+    Args:
+        set_webhook: зарегистрировать адрес в Telegram (делает один воркер)
+        reuse_port: слушать порт вместе с другими процессами (SO_REUSEPORT)
+    """
+    if set_webhook and WEBHOOK_URL:
+        await bot.set_webhook(
+            f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+    
+    runner = web.AppRunner(create_app(bot, dp))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT, reuse_port=reuse_port or None)
+    await site.start()
+    logger.info("Вебхук слушает %s:%s", WEBAPP_HOST, WEBAPP_PORT)
+    
+    # SIGTERM/SIGINT завершают сервер штатно (в т.ч. сигнал от супервизора)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()